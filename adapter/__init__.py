@@ -27,6 +27,7 @@ from adapter.theFanfictionForumAdapter import TheFanfictionForumAdapter
 from adapter.wanderingInnAdapter import WanderingInnAdapter
 from adapter.wavesArisenAdapter import WavesArisenAdapter
 from htypes import FicType, adapters
+import router
 
 
 def registerAdapters() -> None:
@@ -56,6 +57,7 @@ def registerAdapters() -> None:
     adapters[FicType.fanficparadisesfw] = FanficParadiseSFWAdapter()
     adapters[FicType.fanficparadisensfw] = FanficParadiseNSFWAdapter()
     adapters[FicType.wanderinginn] = WanderingInnAdapter()
+    router.reset()
 
 
 # registerAdapters()
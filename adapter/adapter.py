@@ -101,6 +101,16 @@ class Adapter:
                 return u
         return default
 
+    # like getLastLikeOrDefault, but matches against the indexed web.urlKey
+    def getLastKeyOrDefault(self, keyLikes: List[str], default: str) -> str:
+        import scrape
+
+        for keyLike in keyLikes:
+            u = scrape.getLastUrlForKeyLike(keyLike)
+            if u is not None:
+                return u
+        return default
+
     # get the most recent scrape for a chapter, or scrape it fresh
     def softScrape(self, chapter: FicChapter) -> Optional[str]:
         import scrape
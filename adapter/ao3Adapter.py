@@ -285,8 +285,8 @@ class Ao3Adapter(Adapter):
     def getCurrentInfo(self, fic: Fic) -> Fic:
         fic.url = self.baseUrl + str(fic.localId)
         url = fic.url.split("?")[0] + "?view_adult=true"
-        # scrape fresh info
-        data = scrape.scrape(url)
+        # scrape fresh info, a 304 reuses the archived copy
+        data = scrape.scrape(url, revalidate=True)
 
         return self.parseInfoInto(fic, data["raw"])
 
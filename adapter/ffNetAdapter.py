@@ -962,10 +962,8 @@ class FFNAdapter(Adapter):
             util.logMessage(f"unknown fandom {fic.id}: {href}")
 
         fic.upsert()
-        poss = Fic.select({"sourceId": fic.sourceId, "localId": fic.localId})
-        if len(poss) != 1:
+        if fic.id is None:
             raise Exception("unable to upsert fic?")
-        fic = poss[0]
         for pfandom in pendingFandoms:
             fic.add(pfandom)
 
@@ -980,15 +978,21 @@ class FFNAdapter(Adapter):
                 chapterOptions = chapterSelect.findAll("option")
             chapterTitles = [co.getText().strip() for co in chapterOptions]
 
+        existing = {ch.chapterId: ch for ch in FicChapter.select({"ficId": fic.id})}
+        chapters = []
         for cid in range(1, fic.chapterCount + 1):
-            ch = fic.chapter(cid)
+            ch = existing.get(cid, None)
+            if ch is None:
+                ch = FicChapter.new()
+                ch.ficId, ch.chapterId = fic.id, cid
             ch.localChapterId = str(cid)
             ch.url = self.constructUrl(fic.localId, cid)
             if len(chapterTitles) > cid:
                 ch.title = util.cleanChapterTitle(chapterTitles[cid - 1], cid)
             elif fic.chapterCount == 1 and cid == 1:
                 ch.title = fic.title
-            ch.upsert()
+            chapters.append(ch)
+        FicChapter.bulkUpsert(chapters)
 
         metaSpan = profile_top.find("span", {"class": "xgray"})
         if metaSpan is not None:
@@ -1240,7 +1244,7 @@ class FFNAdapter(Adapter):
         # self.constructUrl(fic.localId, chapter.chapterId, fic.title)))
         curl = self.constructUrl(fic.localId, chapter.chapterId, None)
         # util.logMessage(f'FFNAdapter.scrape: {curl}')
-        url = scrape.getLastUrlLike(curl)
+        url = scrape.getLastUrlForKey(scrape.urlKey(curl))
         if url is None:
             url = curl
 
@@ -1255,10 +1259,21 @@ class FFNAdapter(Adapter):
             ts = scrape.getMostRecentScrapeTime(url)
             if ts is None:
                 raise Exception("no most recent scrape time? FIXME")
-            # if we last scraped more than half an hour ago rescrape
-            if int(time.time()) - ts > (60 * 30):
-                url = self.constructUrl(fic.localId, chapter.chapterId, None)
+            # if we last scraped more than half an hour ago rescrape, unless
+            # an earlier rescrape found it missing too and it's backing off
+            if (
+                int(time.time()) - ts > (60 * 30)
+                and scrape.activeNegative(scrape.canonizeUrl(curl)) is None
+            ):
+                url = curl
                 data = self.scrape(url)["raw"]
+                if (
+                    data is not None
+                    and data.lower().find("chapter not found.") != -1
+                    and data.lower().find("id='storytext'") == -1
+                ):
+                    # the page itself is a 200, back off as if it were a 404
+                    scrape.recordNegative(scrape.canonizeUrl(url), 404)
         if data is None:
             raise Exception("unable to scrape? FIXME")
 
@@ -310,7 +310,7 @@ class FictionPressAdapter(Adapter):
 
         curl = self.constructUrl(fic.localId, chapter.chapterId, None)
         # util.logMessage(f'FictionPressAdapter.scrape: {curl}')
-        url = scrape.getLastUrlLike(curl)
+        url = scrape.getLastUrlForKey(scrape.urlKey(curl))
         if url is None:
             url = curl
 
@@ -325,10 +325,21 @@ class FictionPressAdapter(Adapter):
             ts = scrape.getMostRecentScrapeTime(url)
             if ts is None:
                 raise Exception("no most recent scrape time? FIXME")
-            # if we last scraped more than half an hour ago rescrape
-            if int(time.time()) - ts > (60 * 30):
-                url = self.constructUrl(fic.localId, chapter.chapterId, None)
+            # if we last scraped more than half an hour ago rescrape, unless
+            # an earlier rescrape found it missing too and it's backing off
+            if (
+                int(time.time()) - ts > (60 * 30)
+                and scrape.activeNegative(scrape.canonizeUrl(curl)) is None
+            ):
+                url = curl
                 data = self.scrape(url)["raw"]
+                if (
+                    data is not None
+                    and data.lower().find("chapter not found.") != -1
+                    and data.lower().find("id='storytext'") == -1
+                ):
+                    # the page itself is a 200, back off as if it were a 404
+                    scrape.recordNegative(scrape.canonizeUrl(url), 404)
         if data is None:
             raise Exception("unable to scrape? FIXME")
 
@@ -224,7 +224,7 @@ class RoyalRoadlAdapter(Adapter):
 
     def softScrapeUrl(self, origUrl: str) -> Optional[str]:
         url = origUrl
-        lurl = scrape.getLastUrlLike(url)
+        lurl = scrape.getLastUrlForKey(scrape.urlKey(url))
         if lurl is not None:
             url = lurl
 
@@ -1,5 +1,5 @@
 import typing
-from typing import Any, Dict, List, Optional, Set, Tuple, Union, cast
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 if typing.TYPE_CHECKING:
     pass
@@ -473,57 +473,30 @@ class XenForoAdapter(Adapter):
             raise Exception(f"leftover img urls: {leftover}")
 
     def getLastFetchedThreadmarksUrl(self, fic: Fic) -> str:
+        url = f"{self.baseUrl}threads/{fic.localId}/threadmarks?category_id=1"
         if self.baseUrl.find("?") >= 0:
-            return self.getLastLikeOrDefault(
-                [
-                    f"{self.baseUrl}threads/{fic.localId}/threadmarks&category_id=1",
-                    f"{self.baseUrl}threads/%.{fic.localId}/threadmarks&category_id=1",
-                ],
-                f"{self.baseUrl}threads/{fic.localId}/threadmarks&category_id=1",
-            )
-        return self.getLastLikeOrDefault(
-            [
-                f"{self.baseUrl}threads/{fic.localId}/threadmarks?category_id=1",
-                f"{self.baseUrl}threads/%.{fic.localId}/threadmarks?category_id=1",
-            ],
-            f"{self.baseUrl}threads/{fic.localId}/threadmarks?category_id=1",
-        )
+            url = f"{self.baseUrl}threads/{fic.localId}/threadmarks&category_id=1"
+        return self.getLastKeyOrDefault([scrape.likeEscape(scrape.urlKey(url))], url)
 
     def getLastFetchedReaderUrl(self, fic: Fic) -> str:
-        return self.getLastLikeOrDefault(
-            [
-                f"{self.baseUrl}threads/{fic.localId}/reader_%",
-                f"{self.baseUrl}threads/%.{fic.localId}/reader_%",
-            ],
-            f"{self.baseUrl}threads/{fic.localId}/reader",
+        url = f"{self.baseUrl}threads/{fic.localId}/reader"
+        return self.getLastKeyOrDefault(
+            [scrape.likeEscape(scrape.urlKey(url)) + "_%"], url
         )
 
     def getLastFetchedReaderStartUrl(self, fic: Fic) -> str:
-        return self.getLastLikeOrDefault(
-            [
-                f"{self.baseUrl}threads/{fic.localId}/reader",
-                f"{self.baseUrl}threads/%.{fic.localId}/reader",
-            ],
-            f"{self.baseUrl}threads/{fic.localId}/reader",
-        )
+        url = f"{self.baseUrl}threads/{fic.localId}/reader"
+        return self.getLastKeyOrDefault([scrape.likeEscape(scrape.urlKey(url))], url)
 
     def getLastFetchedDeepUrl(self, fic: Fic) -> str:
-        return self.getLastLikeOrDefault(
-            [
-                f"{self.baseUrl}threads/{fic.localId}/page-%",
-                f"{self.baseUrl}threads/%.{fic.localId}/page-%",
-            ],
-            f"{self.baseUrl}threads/{fic.localId}",
+        url = f"{self.baseUrl}threads/{fic.localId}"
+        return self.getLastKeyOrDefault(
+            [scrape.likeEscape(scrape.urlKey(url)) + "/page-%"], url
         )
 
     def getLastFetchedDeepStartUrl(self, fic: Fic) -> str:
-        return self.getLastLikeOrDefault(
-            [
-                f"{self.baseUrl}threads/{fic.localId}",
-                f"{self.baseUrl}threads/%.{fic.localId}",
-            ],
-            f"{self.baseUrl}threads/{fic.localId}",
-        )
+        url = f"{self.baseUrl}threads/{fic.localId}"
+        return self.getLastKeyOrDefault([scrape.likeEscape(scrape.urlKey(url))], url)
 
     def getUrlsToRefetch(self, fic: Fic) -> Set[str]:
         return {
@@ -536,7 +509,7 @@ class XenForoAdapter(Adapter):
             return
         urls = self.getUrlsToRefetch(fic)
         for url in urls:
-            scrape.scrape(url, timeout=30)
+            scrape.scrape(url, timeout=30, revalidate=True)
             time.sleep(self.defaultDelay)
 
         canFail = {
@@ -546,7 +519,7 @@ class XenForoAdapter(Adapter):
         }
         for url in canFail:
             try:
-                scrape.scrape(url, timeout=30)
+                scrape.scrape(url, timeout=30, revalidate=True)
                 time.sleep(self.defaultDelay)
             except Exception as e:
                 # TODO
@@ -1004,23 +977,14 @@ class XenForoAdapter(Adapter):
                 raise Exception("unable to soft scrape? FIXME")
             return data
 
-        ulike = url[len(prefix) :]
-        parts = ulike.split("/")
-        parts[0] = parts[0].split(".")[-1]
-        canon = prefix + "/".join(parts)
-        parts[0] = "%." + parts[0]
-        ulike = prefix + "/".join(parts)
-
-        # FIXME canon may find an older url than ulike :/
-
-        canonRes = scrape.getMostRecentScrapeWithMeta(canon)
-        if (
-            canonRes is not None
-            and int(time.time()) - self.mustyThreshold < canonRes["fetched"]
-        ):
-            return cast(str, canonRes["raw"])
-
-        data = scrape.softScrape(url, delay, ulike, mustyThreshold=self.mustyThreshold)
+        # any spelling of the thread url shares a urlKey, so this finds the
+        # most recent fetch whether or not it had the title slug
+        data = scrape.softScrape(
+            url,
+            delay,
+            ukey=scrape.urlKey(url),
+            mustyThreshold=self.mustyThreshold,
+        )
         if data is None:
             raise Exception("unable to soft scrape? FIXME")
         return data
@@ -8,6 +8,7 @@ import werkzeug.wrappers
 
 import adapter
 from htypes import FicId
+import lite
 from lite import JSONable
 import scrape
 from store import Fic, FicChapter
@@ -24,6 +25,17 @@ app = Flask(__name__)
 app.url_map.strict_slashes = False
 
 
+# each request gets its own identity map, see lite.Session
+@app.before_request
+def begin_session() -> None:
+    lite.beginSession()
+
+
+@app.teardown_request
+def end_session(e: Optional[BaseException]) -> None:
+    lite.endSession()
+
+
 def cleanHtml(html: str) -> str:
     view = HtmlView(html, markdown=False)
     html = "".join([f"<p>{line}</p>" for line in view.text])
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# usage: benchDecode.py check [files...]
+#            compare scrape.decodeRequest against the original replace-by-replace
+#            version on the pages in fixtures/decode/ (or the given files, such
+#            as decodeRequest's failure dumps)
+#        benchDecode.py bench [size] [rounds]
+#            time both versions on a page made of the fixtures
+from typing import Callable, List, Optional, Tuple
+import contextlib
+import functools
+import glob
+import os
+import sys
+import time
+
+import scrape
+
+fixtureDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures/decode")
+
+
+# decodeRequest as it was before it repaired pages in a single pass: every
+# rule is its own replace over the whole page
+def sequentialDecodeRequest(data: bytes) -> str:
+    with contextlib.suppress(UnicodeDecodeError):
+        return data.decode("utf-8")
+
+    scrape.setupCP1252()
+
+    data = data.replace(b"M\xc3\x83\xc2\xb3rr\xc3\x83\xc2\xadgan", b"M\xf3rrigan")
+    data = data.replace(b"fa\xc3\x83\xc2\xa7ade", b"fa\xe7ade")
+
+    data = data.replace(
+        b"#8211;&#8212;&#8211;\xb5&#8211;\xbb&#8211;\xb8",
+        b"#8211;&#8212;&#8211;&#8211;&#8211;",
+    )
+    data = data.replace(
+        b"#8211;&#8211;&#8211;\xb9 &#8211; &#8212;\x83",
+        b"#8211;&#8211;&#8211; &#8211; &#8212;",
+    )
+    data = data.replace(
+        b"&#8211;\xb9 &#8211; &#8212;\x83", b"#8211;&#8211;&#8211; &#8211; &#8212;&#8"
+    )
+
+    for src, dst in scrape.utf8_to_cp1252:
+        data = data.replace(src, dst)
+    for src, dst in scrape.cp1252_munge:
+        data = data.replace(src, dst)
+
+    return data.decode("cp1252")
+
+
+# what decoding data gives: the text, or the name of the error raised
+def outcome(
+    decode: Callable[[bytes], Optional[str]], data: bytes
+) -> Tuple[Optional[str], Optional[str]]:
+    try:
+        return (decode(data), None)
+    except Exception as e:
+        return (None, type(e).__name__)
+
+
+def fixtures() -> List[str]:
+    return sorted(glob.glob(os.path.join(fixtureDir, "*")))
+
+
+def check(paths: List[str]) -> int:
+    if len(paths) == 0:
+        paths = fixtures()
+    bad = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        old = outcome(sequentialDecodeRequest, data)
+        new = outcome(functools.partial(scrape.decodeRequest, url=path), data)
+        if old != new:
+            bad += 1
+            print(f"mismatch: {path}")
+            print(f"  sequential: {old!r}")
+            print(f"  decodeRequest: {new!r}")
+    print(f"checked {len(paths)} pages, {bad} mismatches")
+    return 1 if bad > 0 else 0
+
+
+def bench(size: int, rounds: int) -> None:
+    pages = []
+    for path in fixtures():
+        with open(path, "rb") as f:
+            pages.append(f.read())
+    text = bytearray()
+    while len(text) < size:
+        for page in pages:
+            text += page
+    data = bytes(text)
+    fns = [
+        ("sequential", sequentialDecodeRequest),
+        ("single", lambda d: scrape.decodeRequest(d, "bench")),
+    ]
+    for name, fn in fns:
+        fn(data)
+        start = time.time()
+        for _ in range(rounds):
+            fn(data)
+        elapsed = time.time() - start
+        mbps = len(data) * rounds / elapsed / 1024 / 1024
+        print(f"{name:>10}: {elapsed:.3f}s {mbps:.1f} MiB/s")
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) < 2:
+        print(f"usage: {argv[0]} check [files...] | bench [size] [rounds]")
+        return 1
+    if argv[1] == "check":
+        return check(argv[2:])
+    if argv[1] == "bench":
+        size = int(argv[2]) if len(argv) > 2 else 1024 * 1024
+        rounds = int(argv[3]) if len(argv) > 3 else 20
+        bench(size, rounds)
+        return 0
+    print(f"unknown command: {argv[1]}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
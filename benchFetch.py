@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# usage: benchFetch.py [requests]
+#   serve a small page from a local keep-alive http server and time fetching it
+#   with a new connection per request (plain requests.get) and through a
+#   fetch.SessionPool session
+from typing import Any
+import http.server
+import sys
+import threading
+import time
+
+import requests
+
+import fetch
+
+page = b"<html><body>" + b"chapter text " * 2000 + b"</body></html>"
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # like any real server, don't hold back the body waiting on an ack
+    disable_nagle_algorithm = True
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def main(count: int) -> None:
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/s/1/1/"
+
+    pool = fetch.SessionPool(requests.cookies.RequestsCookieJar())
+    runs = [
+        ("requests.get", lambda: requests.get(url, timeout=15)),
+        ("session", lambda: pool.session(url).get(url, timeout=15)),
+    ]
+    for name, get in runs:
+        get()
+        start = time.time()
+        for _ in range(count):
+            r = get()
+            if r.status_code != 200 or len(r.content) != len(page):
+                raise Exception(f"bad response: {r.status_code}")
+        elapsed = time.time() - start
+        print(f"{name:>12}: {count / elapsed:.0f} requests/s")
+
+    pool.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# usage: benchRouter.py [rounds] < urls
+#   check that router.match picks the same adapter as the old linear scan for
+#   every url on stdin, then time both
+import sys
+import time
+
+import adapter
+import router
+
+adapter.registerAdapters()
+
+rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+urls = [line.strip() for line in sys.stdin if len(line.strip()) > 0]
+
+bad = 0
+for url in urls:
+    if router.match(url) != router.scanMatch(url):
+        bad += 1
+        print(f"mismatch: {url}: {router.match(url)} != {router.scanMatch(url)}")
+print(f"checked {len(urls)} urls, {bad} mismatches")
+
+for name, fn in [("scan", router.scanMatch), ("router", router.match)]:
+    start = time.time()
+    for _ in range(rounds):
+        for url in urls:
+            fn(url)
+    elapsed = time.time() - start
+    print(f"{name:>6}: {elapsed:.3f}s {len(urls) * rounds / elapsed:.0f} urls/s")
+
+sys.exit(1 if bad > 0 else 0)
@@ -0,0 +1,216 @@
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+import os
+import threading
+import zlib
+
+if TYPE_CHECKING:
+    from psycopg2 import connection  # type: ignore[attr-defined]
+
+# Compressed blobs come in two layouts:
+#   legacy: 4 byte big endian length, zlib stream
+#   v1:     0xff, version, codec, 4 byte dictionary id, 4 byte length, payload
+# A legacy blob can never start with 0xff since that would need a length of
+# at least 4GiB, so the first byte is enough to tell them apart.
+headerMagic = 0xFF
+headerVersion = 1
+headerLength = 11
+
+codecZlib = 1
+codecZstd = 2
+codecNames = {"zlib": codecZlib, "zstd": codecZstd}
+
+zlibLevel = 6
+zstdLevel = 3
+
+# a dictionary id of 0 means no dictionary was used
+noDictionary = 0
+
+_defaultCodec: Optional[int] = None
+_dictionaries: Dict[int, Tuple[str, int, bytes]] = {}
+_domainDictionaries: Dict[str, int] = {}
+_dictionariesLoaded = False
+_threadData = threading.local()
+
+
+def haveZstd() -> bool:
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def getDefaultCodec() -> int:
+    global _defaultCodec
+    if _defaultCodec is not None:
+        return _defaultCodec
+    name = os.environ.get("HERMES_CODEC", "zstd" if haveZstd() else "zlib")
+    if name not in codecNames:
+        raise Exception(f"unknown HERMES_CODEC: {name}")
+    _defaultCodec = codecNames[name]
+    return _defaultCodec
+
+
+def getDomain(url: str) -> str:
+    for s in ["http://", "https://"]:
+        if url.startswith(s):
+            url = url[len(s) :]
+    host = url.split("/")[0].split("?")[0].lower()
+    return ".".join(host.split(".")[-2:])
+
+
+def getConnection() -> "connection":
+    from lite_oil import getConnection
+
+    return getConnection("codec")
+
+
+def registerDictionary(did: int, domain: str, codec: int, data: bytes) -> None:
+    _dictionaries[did] = (domain, codec, data)
+    _domainDictionaries[domain] = did
+    # drop any codec built from a previous dictionary with this id
+    codecs = _zstdCodecs()
+    for key in [k for k in codecs if k[1] == did]:
+        del codecs[key]
+
+
+def loadDictionaries() -> None:
+    global _dictionariesLoaded
+    import segment
+
+    directory = segment.getArchiveDirectory()
+    if segment.segmentsOnly() and directory is not None:
+        for did, domain, codec, d in segment.readDictionaries(directory):
+            registerDictionary(did, domain, codec, d)
+        _dictionariesLoaded = True
+        return
+
+    with getConnection().cursor() as curs:
+        curs.execute("select id, domain, codec, dict from web_dict order by id asc")
+        for did, domain, codec, data in curs.fetchall():
+            registerDictionary(did, domain, codec, data.tobytes())
+    getConnection().commit()
+    _dictionariesLoaded = True
+
+
+def getDictionary(did: int) -> Tuple[str, int, bytes]:
+    if did not in _dictionaries:
+        loadDictionaries()
+    if did not in _dictionaries:
+        raise Exception(f"missing compression dictionary: {did}")
+    return _dictionaries[did]
+
+
+def findDictionary(codec: int, url: Optional[str]) -> int:
+    if url is None or codec != codecZstd:
+        return noDictionary
+    if not _dictionariesLoaded:
+        loadDictionaries()
+    did = _domainDictionaries.get(getDomain(url), noDictionary)
+    if did != noDictionary and _dictionaries[did][1] != codec:
+        return noDictionary
+    return did
+
+
+def saveDictionary(domain: str, codec: int, data: bytes) -> int:
+    with getConnection().cursor() as curs:
+        curs.execute(
+            "insert into web_dict(domain, codec, dict) values(%s, %s, %s) returning id",
+            (domain, codec, data),
+        )
+        r = curs.fetchone()
+    getConnection().commit()
+    assert r is not None
+    did = int(r[0])
+    registerDictionary(did, domain, codec, data)
+    return did
+
+
+def _zstdCodecs() -> Dict[Tuple[str, int], Any]:
+    if not hasattr(_threadData, "zstd"):
+        _threadData.zstd = {}
+    return _threadData.zstd  # type: ignore[no-any-return]
+
+
+def _zstdCompressor(did: int, level: int) -> Any:
+    import zstandard
+
+    codecs = _zstdCodecs()
+    key = (f"c{level}", did)
+    if key not in codecs:
+        dictData = None
+        if did != noDictionary:
+            dictData = zstandard.ZstdCompressionDict(getDictionary(did)[2])
+        codecs[key] = zstandard.ZstdCompressor(level=level, dict_data=dictData)
+    return codecs[key]
+
+
+def _zstdDecompressor(did: int) -> Any:
+    import zstandard
+
+    codecs = _zstdCodecs()
+    key = ("d", did)
+    if key not in codecs:
+        dictData = None
+        if did != noDictionary:
+            dictData = zstandard.ZstdCompressionDict(getDictionary(did)[2])
+        codecs[key] = zstandard.ZstdDecompressor(dict_data=dictData)
+    return codecs[key]
+
+
+def compressWith(s: bytes, codec: int, did: int = noDictionary) -> bytes:
+    if codec == codecZlib:
+        if did != noDictionary:
+            raise Exception("zlib does not support compression dictionaries")
+        payload = zlib.compress(s, level=zlibLevel)
+    elif codec == codecZstd:
+        payload = _zstdCompressor(did, zstdLevel).compress(s)
+    else:
+        raise Exception(f"unknown codec: {codec}")
+    header = bytes([headerMagic, headerVersion, codec])
+    header += did.to_bytes(4, byteorder="big")
+    header += len(s).to_bytes(4, byteorder="big")
+    return header + payload
+
+
+def compress(s: bytes, url: Optional[str] = None) -> bytes:
+    codec = getDefaultCodec()
+    return compressWith(s, codec, findDictionary(codec, url))
+
+
+def describe(b: bytes) -> Tuple[int, int]:
+    if len(b) < 1 or b[0] != headerMagic:
+        return (codecZlib, noDictionary)
+    if len(b) < headerLength:
+        raise Exception(f"truncated compression header: {len(b)} bytes")
+    if b[1] != headerVersion:
+        raise Exception(f"unknown compression header version: {b[1]}")
+    return (b[2], int.from_bytes(b[3:7], byteorder="big"))
+
+
+def decompress(b: bytes) -> bytes:
+    if len(b) < 1 or b[0] != headerMagic:
+        elen = int.from_bytes(b[:4], byteorder="big")
+        res = zlib.decompress(b[4:])
+    else:
+        codec, did = describe(b)
+        elen = int.from_bytes(b[7:headerLength], byteorder="big")
+        payload = b[headerLength:]
+        if codec == codecZlib:
+            res = zlib.decompress(payload)
+        elif codec == codecZstd:
+            if not haveZstd():
+                raise Exception("zstd compressed data but zstandard is not installed")
+            res = _zstdDecompressor(did).decompress(payload, max_output_size=elen)
+        else:
+            raise Exception(f"unknown codec: {codec}")
+    if len(res) != elen:
+        raise Exception(f"expected {elen} but got {len(res)} bytes")
+    return res
+
+
+def trainDictionary(samples: List[bytes], size: int) -> bytes:
+    import zstandard
+
+    d = zstandard.train_dictionary(size, samples)
+    return d.as_bytes()
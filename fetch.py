@@ -0,0 +1,200 @@
+from typing import TYPE_CHECKING, Any, Dict, Optional
+import asyncio
+import functools
+import os
+import random
+import threading
+import time
+
+from codec import getDomain
+
+if TYPE_CHECKING:
+    import requests
+
+# Requests are paced per domain instead of by sleeping after every request:
+# each domain has a token bucket that refills one token per politeness
+# interval, and a request first waits for a token from its domain's bucket.
+# Requests to different domains never wait on each other, but get blocks its
+# caller, so a single scraping thread still fetches one page at a time and
+# only gains the pacing. The http requests themselves are blocking requests
+# calls run on the event loop's executor.
+#
+# Each domain also gets its own requests.Session so connections are kept alive
+# and reused instead of paying for a new TCP and TLS handshake per page. The
+# sessions share one cookie jar, seeded from priv.getDefaultCookies, so
+# cookies a site sets are sent back on later requests.
+poolSize = 4
+
+
+# seconds to wait for a connection to be established, HERMES_CONNECT_TIMEOUT.
+# The timeout passed to get is how long to wait for the response.
+def getConnectTimeout() -> float:
+    return float(os.environ.get("HERMES_CONNECT_TIMEOUT", "10"))
+
+
+class SessionPool:
+    def __init__(
+        self, cookies: Optional["requests.cookies.RequestsCookieJar"] = None
+    ) -> None:
+        self.sessions: Dict[str, "requests.Session"] = {}
+        self.cookies = cookies
+        self.lock = threading.Lock()
+
+    def defaultCookies(self) -> "requests.cookies.RequestsCookieJar":
+        if self.cookies is None:
+            import priv
+
+            self.cookies = priv.getDefaultCookies()
+        return self.cookies
+
+    def session(self, url: str) -> "requests.Session":
+        domain = getDomain(url)
+        with self.lock:
+            if domain not in self.sessions:
+                import requests
+
+                s = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=poolSize, pool_maxsize=poolSize
+                )
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                s.cookies = self.defaultCookies()
+                self.sessions[domain] = s
+            return self.sessions[domain]
+
+    def close(self) -> None:
+        with self.lock:
+            for s in self.sessions.values():
+                s.close()
+            self.sessions = {}
+
+
+_sessions = SessionPool()
+
+
+# the keep-alive session for url's domain
+def getSession(url: str) -> "requests.Session":
+    return _sessions.session(url)
+
+
+# a blocking get through url's session. cookies are sent along with the
+# shared jar's.
+def sessionGet(
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    cookies: Any = None,
+    timeout: float = 15,
+    **kwargs: Any,
+) -> "requests.Response":
+    connectTimeout = min(timeout, getConnectTimeout())
+    return getSession(url).get(
+        url,
+        headers=headers,
+        cookies=cookies,
+        timeout=(connectTimeout, timeout),
+        **kwargs,
+    )
+
+
+# the time to leave between two requests to the same domain for a requested
+# delay. This keeps the random jitter scrape.delaySecs always added.
+def politeInterval(delay: float) -> float:
+    if delay < 0.05:
+        return delay + 0.10 * random.random() + 0.01
+    if delay < 0.25:
+        return delay + 0.75 * random.random() + 0.25
+    return delay + 3.5 * random.random() + 1.0
+
+
+class TokenBucket:
+    def __init__(self, burst: int = 1) -> None:
+        self.burst = burst
+        self.tokens = float(burst)
+        self.interval = 0.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.interval <= 0:
+            self.tokens = float(self.burst)
+        else:
+            elapsed = now - self.updated
+            self.tokens = min(float(self.burst), self.tokens + elapsed / self.interval)
+        self.updated = now
+
+    # wait for a token. interval is how long this request wants the domain
+    # left alone afterwards, it sets the refill rate until the next acquire.
+    async def acquire(self, interval: float) -> None:
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) * self.interval)
+                self._refill()
+            self.tokens -= 1
+            self.interval = interval
+
+    # start the interval over once the request finishes, so a slow response
+    # doesn't eat into the time the domain is left alone
+    def release(self) -> None:
+        self.updated = time.monotonic()
+
+
+class FetchEngine:
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="fetch", daemon=True
+        )
+        self.thread.start()
+
+    def bucket(self, domain: str) -> TokenBucket:
+        if domain not in self.buckets:
+            self.buckets[domain] = TokenBucket()
+        return self.buckets[domain]
+
+    async def fetch(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        cookies: Any = None,
+        timeout: float = 15,
+        delay: float = 3,
+    ) -> "requests.Response":
+        bucket = self.bucket(getDomain(url))
+        await bucket.acquire(politeInterval(delay))
+        get = functools.partial(
+            sessionGet, url, headers=headers, cookies=cookies, timeout=timeout
+        )
+        try:
+            return await self.loop.run_in_executor(None, get)
+        finally:
+            bucket.release()
+
+
+_engine: Optional[FetchEngine] = None
+_engineLock = threading.Lock()
+
+
+def getEngine() -> FetchEngine:
+    global _engine
+    with _engineLock:
+        if _engine is None:
+            _engine = FetchEngine()
+    return _engine
+
+
+# blocking wrapper around FetchEngine.fetch for synchronous callers
+def get(
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    cookies: Any = None,
+    timeout: float = 15,
+    delay: float = 3,
+) -> "requests.Response":
+    engine = getEngine()
+    return asyncio.run_coroutine_threadsafe(
+        engine.fetch(url, headers, cookies, timeout, delay), engine.loop
+    ).result()
@@ -235,13 +235,11 @@ class FicId:
 
     @staticmethod
     def tryParseUrl(url: str) -> Optional["FicId"]:
-        for ftype in adapters:
-            a = adapters[ftype]
-            if a is None:
-                continue
-            for fragment in a.urlFragments:
-                if url.find(fragment) != -1:
-                    return a.tryParseUrl(url)
+        import router
+
+        ftype, _ = router.match(url)
+        if ftype is not None:
+            return getAdapter(ftype).tryParseUrl(url)
         return FicId.tryParseFallback(url)
 
     @staticmethod
@@ -259,14 +257,9 @@ class FicId:
 
     @staticmethod
     def guessFicType(ident: str) -> Tuple[Optional[FicType], Optional[str]]:
-        for ftype in adapters:
-            a = adapters[ftype]
-            if a is None:
-                continue
-            for fragment in a.urlFragments:
-                if ident.find(fragment) != -1:
-                    return (ftype, fragment)
-        return (None, None)
+        import router
+
+        return router.match(ident)
 
     @staticmethod
     def help() -> str:
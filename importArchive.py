@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# bulk import saved crawls into web.
+#
+# usage: importArchive.py <state file> [workers] <source>...
+#   each source is either a WARC file (.warc or .warc.gz) or a directory
+#   mirrored by wget -x (host/path/... under it). Only response records are
+#   taken from WARCs; files in a directory are imported as 200s fetched at
+#   their mtime, with the url rebuilt from their path.
+#
+#   Records are read in order and handed to a pool of workers that decode,
+#   hash and compress them and work out the canonical url and urlKey. Rows
+#   come back in order and are loaded with COPY into staging tables, then
+#   moved into web_blob and web; rows for a url already saved with the same
+#   fetch time are skipped, so replaying a batch is harmless.
+#
+#   How many records of each source have been committed is kept in the state
+#   file, so an interrupted import picks up where it stopped when run again
+#   with the same state file.
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple, Union
+import calendar
+import datetime
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+
+import scrape
+import util
+
+# (source, index within source, url, fetched, status, body); a body of None
+# marks the end of a source
+Record = Tuple[str, int, str, int, int, Optional[bytes]]
+# (source, index, end of source, created, url, urlKey, status, hash,
+# compressed body); hash and body are None for records that couldn't be
+# imported and for the end marker
+Row = Tuple[str, int, bool, int, str, str, int, Optional[bytes], Optional[bytes]]
+
+Stream = Union[IO[bytes], gzip.GzipFile]
+
+batchRecords = 64
+copyRows = 2000
+
+
+def parseWarcDate(s: str) -> int:
+    s = s.strip().rstrip("Z")
+    fmt = "%Y-%m-%dT%H:%M:%S.%f" if "." in s else "%Y-%m-%dT%H:%M:%S"
+    return calendar.timegm(datetime.datetime.strptime(s, fmt).timetuple())
+
+
+def readHeaders(f: Stream) -> Optional[Dict[str, str]]:
+    headers: Dict[str, str] = {}
+    while True:
+        line = f.readline()
+        if len(line) == 0:
+            return None if len(headers) == 0 else headers
+        line = line.rstrip(b"\r\n")
+        if len(line) == 0:
+            return headers
+        if b":" not in line:
+            headers[":first"] = line.decode("latin-1")
+            continue
+        k, v = line.split(b":", 1)
+        headers[k.decode("latin-1").strip().lower()] = v.decode("latin-1").strip()
+
+
+def unchunk(body: bytes) -> bytes:
+    res = bytearray()
+    pos = 0
+    while pos < len(body):
+        eol = body.find(b"\r\n", pos)
+        if eol < 0:
+            break
+        size = int(body[pos:eol].split(b";")[0] or b"0", 16)
+        if size == 0:
+            break
+        res += body[eol + 2 : eol + 2 + size]
+        pos = eol + 2 + size + 2
+    return bytes(res)
+
+
+# split an http response as stored in a WARC response record into its status
+# and body, undoing any transfer and content encoding
+def parseHttpResponse(block: bytes) -> Tuple[int, bytes]:
+    f = io.BytesIO(block)
+    headers = readHeaders(f)
+    if headers is None or ":first" not in headers:
+        raise Exception("missing http status line")
+    status = int(headers[":first"].split(" ")[1])
+    body = f.read()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body = unchunk(body)
+    encoding = headers.get("content-encoding", "").lower()
+    if encoding in {"gzip", "x-gzip"}:
+        body = gzip.decompress(body)
+    elif encoding == "deflate":
+        try:
+            body = zlib.decompress(body)
+        except zlib.error:
+            body = zlib.decompress(body, -zlib.MAX_WBITS)
+    return (status, body)
+
+
+def readWarc(path: str, skip: int) -> Iterator[Record]:
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield from readWarcRecords(path, f, skip)
+    else:
+        with open(path, "rb") as f:
+            yield from readWarcRecords(path, f, skip)
+
+
+def readWarcRecords(path: str, f: Stream, skip: int) -> Iterator[Record]:
+    index = 0
+    while True:
+        headers = readHeaders(f)
+        if headers is None:
+            break
+        if not headers.get(":first", "").startswith("WARC/"):
+            raise Exception(f"readWarc: {path}: bad record header {headers}")
+        block = f.read(int(headers["content-length"]))
+        f.readline()
+        f.readline()
+        if headers.get("warc-type") != "response":
+            continue
+        index += 1
+        if index <= skip:
+            continue
+        url = headers["warc-target-uri"].strip("<>")
+        fetched = parseWarcDate(headers["warc-date"])
+        try:
+            status, body = parseHttpResponse(block)
+        except Exception as e:
+            util.logMessage(f"importArchive: {path}: {url}: {e}")
+            continue
+        yield (path, index, url, fetched, status, body)
+    yield (path, index, "", 0, 0, None)
+
+
+def listDirectory(path: str) -> List[str]:
+    res: List[str] = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            res.append(os.path.join(root, name))
+    return res
+
+
+# files under a wget -x mirror; host/a/b becomes https://host/a/b and
+# host/a/index.html becomes https://host/a
+def readDirectory(path: str, skip: int) -> Iterator[Record]:
+    files = listDirectory(path)
+    for index, fname in enumerate(files, 1):
+        if index <= skip:
+            continue
+        rel = os.path.relpath(fname, path).replace(os.sep, "/")
+        if rel.endswith("/index.html"):
+            rel = rel[: -len("/index.html")]
+        with open(fname, "rb") as f:
+            body = f.read()
+        yield (path, index, "https://" + rel, int(os.path.getmtime(fname)), 200, body)
+    yield (path, len(files), "", 0, 0, None)
+
+
+def readSource(path: str, skip: int) -> Iterator[Record]:
+    if os.path.isdir(path):
+        return readDirectory(path, skip)
+    if path.endswith(".warc") or path.endswith(".warc.gz"):
+        return readWarc(path, skip)
+    raise Exception(f"importArchive: not a directory or WARC file: {path}")
+
+
+def skippedRow(record: Record) -> Row:
+    source, index, url, fetched, status, body = record
+    return (source, index, body is None, fetched, url, "", status, None, None)
+
+
+def processRecord(record: Record) -> Row:
+    source, index, url, fetched, status, body = record
+    if body is None:
+        return skippedRow(record)
+    url = scrape.canonizeUrl(url)
+    text = scrape.decodeRequest(body, url)
+    if text is None:
+        return skippedRow(record)
+    raw = text.encode("utf-8")
+    return (
+        source,
+        index,
+        False,
+        fetched,
+        url,
+        scrape.urlKey(url),
+        status,
+        scrape.hashWebResponse(raw),
+        util.compress(raw, url),
+    )
+
+
+def processBatch(records: List[Record]) -> List[Row]:
+    res = []
+    for record in records:
+        try:
+            res.append(processRecord(record))
+        except Exception as e:
+            util.logMessage(f"importArchive: {record[0]}: {record[2]}: {e}")
+            res.append(skippedRow(record))
+    return res
+
+
+def batches(sources: List[str], state: Dict[str, Any]) -> Iterator[List[Record]]:
+    batch: List[Record] = []
+    for source in sources:
+        progress = state.get(source, {"records": 0, "done": False})
+        if progress["done"]:
+            print(f"import: {source}: already imported, skipping")
+            continue
+        for record in readSource(source, progress["records"]):
+            batch.append(record)
+            if len(batch) >= batchRecords:
+                yield batch
+                batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def copyEscape(s: str) -> str:
+    return (
+        s.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copyBytes(b: bytes) -> str:
+    return "\\\\x" + b.hex()
+
+
+# COPY rows into the staging tables and move them into web_blob and web
+def loadRows(conn: Any, rows: List[Row], source: str) -> int:
+    blobs: Dict[bytes, bytes] = {}
+    web = io.StringIO()
+    for _, _, _, created, url, ukey, status, rhash, body in rows:
+        if rhash is None or body is None:
+            continue
+        blobs.setdefault(rhash, body)
+        web.write(
+            f"{created}\t{copyEscape(url)}\t{copyEscape(ukey)}\t{status}"
+            + f"\t{copyBytes(rhash)}\t{copyEscape(source)}\n"
+        )
+    blob = io.StringIO()
+    for rhash, body in blobs.items():
+        blob.write(f"{copyBytes(rhash)}\t{copyBytes(body)}\n")
+    web.seek(0)
+    blob.seek(0)
+
+    curs = conn.cursor()
+    curs.copy_expert("copy import_blob(hash, response) from stdin", blob)
+    curs.copy_expert(
+        "copy import_web(created, url, urlKey, status, responseHash, source)"
+        + " from stdin",
+        web,
+    )
+    curs.execute(
+        """
+        insert into web_blob(hash, response)
+        select distinct on (hash) hash, response from import_blob
+        on conflict (hash) do nothing
+        """
+    )
+    curs.execute(
+        """
+        insert into web(created, url, urlKey, status, responseHash, source)
+        select distinct on (i.url, i.created)
+            i.created, i.url, i.urlKey, i.status, i.responseHash, i.source
+        from import_web i
+        where not exists (
+            select 1 from web w where w.url = i.url and w.created = i.created
+        )
+        """
+    )
+    inserted = int(curs.rowcount)
+    curs.execute("truncate import_web, import_blob")
+    curs.close()
+    conn.commit()
+    return inserted
+
+
+def createStaging(conn: Any) -> None:
+    curs = conn.cursor()
+    curs.execute(
+        """
+        create temp table import_web (
+            created bigint not null,
+            url text not null,
+            urlKey text not null,
+            status smallint not null,
+            responseHash bytea not null,
+            source varchar(64) null
+        )"""
+    )
+    curs.execute(
+        """
+        create temp table import_blob (
+            hash bytea not null,
+            response bytea not null
+        )"""
+    )
+    curs.close()
+    conn.commit()
+
+
+def loadState(path: str) -> Dict[str, Any]:
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        state: Dict[str, Any] = json.load(f)
+    return state
+
+
+def saveState(path: str, state: Dict[str, Any]) -> None:
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def importSources(statePath: str, sources: List[str], workers: int) -> None:
+    sources = [os.path.abspath(s) for s in sources]
+    state = loadState(statePath)
+    conn = scrape.openMinerva()
+    createStaging(conn)
+
+    start = time.time()
+    records, imported, byteCount = 0, 0, 0
+    pending: List[Row] = []
+
+    def flush() -> None:
+        nonlocal imported
+        if len(pending) == 0:
+            return
+        # each source is loaded under its own name and its progress recorded
+        # once its rows are committed
+        bySource: Dict[str, List[Row]] = {}
+        for row in pending:
+            bySource.setdefault(row[0], []).append(row)
+        for source, rows in bySource.items():
+            name = ("import:" + os.path.basename(source))[:64]
+            imported += loadRows(conn, rows, name)
+            state[source] = {
+                "records": max([r[1] for r in rows]),
+                "done": any([r[2] for r in rows]),
+            }
+        saveState(statePath, state)
+        pending.clear()
+
+        elapsed = max(0.001, time.time() - start)
+        print(
+            f"import: {records} records, {imported} new rows,"
+            + f" {byteCount / 1024 / 1024:.1f} MiB in {elapsed:.0f}s"
+            + f" ({records / elapsed:.1f} records/s)"
+        )
+
+    with multiprocessing.Pool(workers) as pool:
+        for rows in pool.imap(processBatch, batches(sources, state)):
+            for row in rows:
+                if not row[2]:
+                    records += 1
+                if row[8] is not None:
+                    byteCount += len(row[8])
+                pending.append(row)
+            if len(pending) >= copyRows:
+                flush()
+        flush()
+
+    scrape.closeMinerva()
+    print(f"import: done, {imported} new rows from {records} records")
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) < 3:
+        print(f"usage: {argv[0]} <state file> [workers] <source>...")
+        return 1
+    statePath = argv[1]
+    workers = os.cpu_count() or 1
+    sources = argv[2:]
+    if sources[0].isdigit() and not os.path.exists(sources[0]):
+        workers = int(sources[0])
+        sources = sources[1:]
+    if len(sources) == 0:
+        print(f"usage: {argv[0]} <state file> [workers] <source>...")
+        return 1
+    importSources(statePath, sources, workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
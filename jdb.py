@@ -200,6 +200,7 @@ def dumpDB():
     }
 
     fics = Fic.select()
+    Fic.prefetchTags(fics)
     for fic in fics:
         k = f"{fic.type}/{fic.localId}"
         o = fic.__dict__.copy()
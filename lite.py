@@ -1,7 +1,9 @@
 from typing import (
     TYPE_CHECKING,
     Any,
+    Callable,
     Dict,
+    Iterator,
     List,
     Optional,
     Sequence,
@@ -9,9 +11,12 @@ from typing import (
     Type,
     TypeVar,
 )
+import contextlib
+import os
 import re
 import threading
 
+import lite_oil
 from lite_oil import getConnection
 from lite_oil import shutdown as shutdown
 from schema import ColumnInfo
@@ -40,6 +45,26 @@ __tableNames: Dict[str, str] = {
 autocommit: bool = True
 logQueries: bool = False
 
+# connections are shared by every thread, so writes and transaction() blocks
+# on one hold its lock; see connectionLock
+__connectionLocks: Dict[int, "threading.RLock"] = {}
+__transactionLock = threading.Lock()
+
+# called whenever transaction() or deferCommits() rolls writes back, so
+# caches of rows written inside can forget them; see onRollback
+__rollbackHooks: List[Callable[[], None]] = []
+
+# rows per round trip for iterSelect
+defaultFetchSize = 1000
+__iterCursors = 0
+
+
+def nextCursorName() -> str:
+    global __iterCursors
+    with __transactionLock:
+        __iterCursors += 1
+        return f"lite_iter_{__iterCursors}"
+
 
 def getTableName(clsName: str) -> str:
     global __tableNames
@@ -78,22 +103,228 @@ def logQuery(kind: str, table: str, sql: str, data: Sequence[Any]) -> None:
     util.logMessage(f"{kind}: sql={sql} data={data}")
 
 
+def onRollback(hook: Callable[[], None]) -> None:
+    __rollbackHooks.append(hook)
+
+
+def rolledBack() -> None:
+    discardSession()
+    for hook in __rollbackHooks:
+        hook()
+
+
+# held while writing to conn and for the whole of a transaction() on it, so
+# one thread's writes can't land in (or be committed by) another's block
+def connectionLock(conn: "connection") -> "threading.RLock":
+    with __transactionLock:
+        if id(conn) not in __connectionLocks:
+            __connectionLocks[id(conn)] = threading.RLock()
+        return __connectionLocks[id(conn)]
+
+
+# open transaction() blocks on each connection by this thread
+def transactionDepths() -> Dict[int, int]:
+    depths: Optional[Dict[int, int]] = getattr(__threadData, "transactions", None)
+    if depths is None:
+        depths = {}
+        __threadData.transactions = depths
+    return depths
+
+
+# commit a single write unless commits are deferred or a transaction() on
+# this connection is open
+def commitWrite(conn: "connection") -> None:
+    if not autocommit:
+        return
+    if transactionDepths().get(id(conn), 0) > 0:
+        return
+    conn.commit()
+
+
+# group writes to subDB so they commit (or roll back) together. Nested blocks,
+# and blocks run while commits are deferred, become savepoints: an exception
+# rolls back just that block before propagating.
+@contextlib.contextmanager
+def transaction(subDB: str = "meta") -> Iterator[None]:
+    conn = getConnection(subDB)
+    with connectionLock(conn):
+        depths = transactionDepths()
+        depth = depths.get(id(conn), 0)
+        depths[id(conn)] = depth + 1
+        savepoint = None if depth == 0 and autocommit else f"lite_sp_{depth}"
+        try:
+            if savepoint is not None:
+                with conn.cursor() as curs:
+                    curs.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield
+            except BaseException:
+                if savepoint is None:
+                    conn.rollback()
+                else:
+                    with conn.cursor() as curs:
+                        curs.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                rolledBack()
+                raise
+            if savepoint is None:
+                conn.commit()
+            else:
+                with conn.cursor() as curs:
+                    curs.execute(f"RELEASE SAVEPOINT {savepoint}")
+        finally:
+            depths[id(conn)] -= 1
+
+
+# hold every commit until the block finishes, then commit all connections at
+# once; an exception rolls everything back instead. Nested blocks normally
+# join the outer one; a fresh block first commits what is already pending, so
+# it commits or rolls back on its own.
+@contextlib.contextmanager
+def deferCommits(fresh: bool = False) -> Iterator[None]:
+    global autocommit
+    outer = autocommit
+    if not outer and not fresh:
+        yield
+        return
+    if not outer:
+        lite_oil.commit()
+    autocommit = False
+    try:
+        yield
+    except BaseException:
+        lite_oil.rollback()
+        rolledBack()
+        raise
+    else:
+        lite_oil.commit()
+    finally:
+        autocommit = outer
+
+
+# the scope of one hermes command or api request: an identity map session,
+# and with HERMES_DEFER_COMMIT set a single commit at the end. Long running
+# commands (repl, work) open a fresh unit per line or job so each commits as
+# it finishes and doesn't see objects loaded by earlier ones.
+@contextlib.contextmanager
+def unitOfWork(fresh: bool = False) -> Iterator[None]:
+    with session(fresh):
+        if "HERMES_DEFER_COMMIT" not in os.environ:
+            yield
+            return
+        with deferCommits(fresh):
+            yield
+
+
 T = TypeVar("T", bound="StoreType")
 
+IdentityKey = Tuple[str, Tuple[Any, ...]]
+
+
+# An identity map for a unit of work such as one command or request. While a
+# session is open get and lookup hand back the object already loaded for a
+# (table, primary key) instead of selecting it again, and rows returned by a
+# filtered select are the same objects get would return. insert and update
+# write through to it, so it never holds an older copy than the database as
+# long as writes go through StoreType.
+class Session:
+    def __init__(self) -> None:
+        self.objects: Dict[IdentityKey, "StoreType"] = {}
+        self.depth = 0
+
+    def find(self, cls: Type[T], key: IdentityKey) -> Optional[T]:
+        obj = self.objects.get(key, None)
+        # several classes can share a table (Genre, Tag, ...)
+        if obj is None or not isinstance(obj, cls):
+            return None
+        return obj
+
+    def add(self, key: IdentityKey, obj: "StoreType") -> None:
+        self.objects[key] = obj
+
+    def evict(self, key: IdentityKey) -> None:
+        self.objects.pop(key, None)
+
+    def clear(self) -> None:
+        self.objects.clear()
+
+
+def getSession() -> Optional[Session]:
+    return getattr(__threadData, "session", None)
+
+
+# open a session on this thread; nested calls share the outermost session
+def beginSession() -> Session:
+    s = getSession()
+    if s is None:
+        s = Session()
+        __threadData.session = s
+    s.depth += 1
+    return s
+
+
+def endSession() -> None:
+    s = getSession()
+    if s is None:
+        return
+    s.depth -= 1
+    if s.depth <= 0:
+        __threadData.session = None
+
+
+# objects in the session may hold writes that were just rolled back (or never
+# made it to the database), so forget them all
+def discardSession() -> None:
+    s = getSession()
+    if s is not None:
+        s.clear()
+
+
+# a session for the block. A fresh session replaces the thread's current one
+# until the block ends instead of sharing it. The session is cleared if the
+# block raises.
+@contextlib.contextmanager
+def session(fresh: bool = False) -> Iterator[Session]:
+    outer = getSession() if fresh else None
+    if fresh:
+        __threadData.session = None
+    s = beginSession()
+    try:
+        yield s
+    except BaseException:
+        s.clear()
+        raise
+    finally:
+        endSession()
+        if fresh:
+            __threadData.session = outer
+
 
 class StoreType:
     subDB: str = "meta"
     columns: List[ColumnInfo]
     pkColumns: List[ColumnInfo]
     regColumns: List[ColumnInfo]
+    # set by schema.generateBaseClasses; older store_bases leave it to
+    # getGeneratedColumns to work out
+    generatedColumns: Optional[List[ColumnInfo]] = None
+    # whether rows are kept in the session's identity map; tables with large
+    # rows can turn this off so long commands don't pin them all
+    sessionCached: bool = True
 
     @classmethod
     def getConnection(cls) -> "connection":
         return getConnection(cls.subDB)
 
+    @classmethod
+    def getGeneratedColumns(cls) -> List[ColumnInfo]:
+        if cls.generatedColumns is not None:
+            return cls.generatedColumns
+        return [col for col in cls.columns if col.type.lower().find("serial") >= 0]
+
     @classmethod
     def getNonGeneratedColumns(cls) -> List[ColumnInfo]:
-        return [col for col in cls.columns if col.type.lower().find("serial") < 0]
+        generated = {col.name for col in cls.getGeneratedColumns()}
+        return [col for col in cls.columns if col.name not in generated]
 
     @classmethod
     def getTableName(cls) -> str:
@@ -106,9 +337,40 @@ class StoreType:
     def toJSONable(self) -> JSONable:
         raise NotImplementedError()
 
+    # the open session, unless this table opts out of it
+    @classmethod
+    def getSession(cls) -> Optional[Session]:
+        return getSession() if cls.sessionCached else None
+
+    @classmethod
+    def identityKey(cls, pkValues: Sequence[Any]) -> IdentityKey:
+        return (cls.getTableName(), tuple(pkValues))
+
+    # remember obj in the open session, if any. Returns the object the session
+    # already holds for the same row instead when there is one.
+    @classmethod
+    def remember(cls: Type[T], obj: T) -> T:
+        s = cls.getSession()
+        if s is None:
+            return obj
+        pkValues = obj.getPKTuple()
+        if any([v is None for v in pkValues]):
+            return obj
+        key = cls.identityKey(pkValues)
+        existing = s.find(cls, key)
+        if existing is not None:
+            return existing
+        s.add(key, obj)
+        return obj
+
     @classmethod
     def get(cls: Type[T], pkValues: Sequence[Any]) -> Optional[T]:
         table = cls.getTableName()
+        s = cls.getSession()
+        if s is not None:
+            cached = s.find(cls, cls.identityKey(pkValues))
+            if cached is not None:
+                return cached
 
         conn = cls.getConnection()
         sql = f"SELECT * FROM {table} WHERE "
@@ -125,7 +387,7 @@ class StoreType:
         if r is None:
             return None
 
-        return cls.fromRow(r)
+        return cls.remember(cls.fromRow(r))
 
     @classmethod
     def lookup(cls: Type[T], pkValues: Sequence[Any]) -> T:
@@ -179,8 +441,49 @@ class StoreType:
             curs.execute(sql, data)
             res = [cls.fromRow(r) for r in curs.fetchall()]
 
+        # whole table scans are left out of the session to keep it small
+        if cls.getSession() is not None and len(data) > 0:
+            res = [cls.remember(r) for r in res]
         return res
 
+    # like select, but streams rows through a server side cursor fetchSize at a
+    # time instead of loading them all. The cursor is WITH HOLD so writes
+    # committed while iterating don't close it. Rows are not remembered in
+    # the session.
+    @classmethod
+    def iterSelect(
+        cls: Type[T],
+        whereData: Optional[Dict[str, Any]] = None,
+        orderBy: Optional[str] = None,
+        fetchSize: int = defaultFetchSize,
+    ) -> Iterator[T]:
+        table = cls.getTableName()
+        conn = cls.getConnection()
+
+        data, whereSql = StoreType.buildWhere(whereData)
+        sql = f"SELECT * FROM {table} {whereSql}"
+
+        if orderBy is not None:
+            sql += " ORDER BY " + orderBy
+
+        curs = conn.cursor(name=nextCursorName(), withhold=True)
+        curs.itersize = fetchSize
+        try:
+            logQuery("iterSelect", table, sql, data)
+            curs.execute(sql, data)
+            for r in curs:
+                yield cls.fromRow(r)
+        finally:
+            # closing a named cursor runs CLOSE on the server, which fails in an
+            # aborted transaction and would hide the error that aborted it
+            from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+
+            if (
+                not conn.closed
+                and conn.get_transaction_status() != TRANSACTION_STATUS_INERROR
+            ):
+                curs.close()
+
     @classmethod
     def count(cls, whereData: Optional[Dict[str, Any]] = None) -> int:
         table = cls.getTableName()
@@ -214,25 +517,37 @@ class StoreType:
     def getNonPKTuple(self) -> Sequence[Any]:
         return self.__getParts([col.name for col in type(self).regColumns])
 
+    # copy every column of row into self
+    def hydrate(self, row: Sequence[Any]) -> None:
+        fresh = type(self).fromRow(row)
+        for col in type(self).columns:
+            self.__dict__[col.name] = fresh.__dict__[col.name]
+
+    # insert self, then fill in generated columns (and anything triggers or
+    # defaults changed) from the inserted row
     def insert(self) -> None:
         table = type(self).getTableName()
         cols = type(self).getNonGeneratedColumns()
-        sql = "INSERT INTO {}({}) VALUES({})".format(
+        sql = "INSERT INTO {}({}) VALUES({}) RETURNING *".format(
             table, ", ".join([c.name for c in cols]), ", ".join(["%s"] * len(cols))
         )
         data = self.toInsertTuple()
         conn = type(self).getConnection()
-        with conn.cursor() as curs:
-            try:
-                logQuery("insert", table, sql, data)
-                curs.execute(sql, data)
-            except:
-                util.logMessage(f"failed to insert: {sql}: {data}", "lite.log")
-                raise
-
-        global autocommit
-        if autocommit:
-            conn.commit()
+        with connectionLock(conn):
+            with conn.cursor() as curs:
+                try:
+                    logQuery("insert", table, sql, data)
+                    curs.execute(sql, data)
+                    row = curs.fetchone()
+                except:
+                    util.logMessage(f"failed to insert: {sql}: {data}", "lite.log")
+                    raise
+            if row is not None:
+                self.hydrate(row)
+
+            self.writeThrough()
+
+            commitWrite(conn)
 
     def update(self) -> None:
         table = type(self).getTableName()
@@ -245,20 +560,112 @@ class StoreType:
         data = tuple(list(self.getNonPKTuple()) + list(self.getPKTuple()))
 
         conn = type(self).getConnection()
-        with conn.cursor() as curs:
-            logQuery("update", table, sql, data)
-            curs.execute(sql, data)
+        with connectionLock(conn):
+            with conn.cursor() as curs:
+                logQuery("update", table, sql, data)
+                curs.execute(sql, data)
+
+            self.writeThrough()
+
+            commitWrite(conn)
+
+    # make self the session's copy of its row after writing it
+    def writeThrough(self) -> None:
+        s = type(self).getSession()
+        if s is None:
+            return
+        pkValues = self.getPKTuple()
+        if any([v is None for v in pkValues]):
+            return
+        s.add(type(self).identityKey(pkValues), self)
 
-        global autocommit
-        if autocommit:
-            conn.commit()
+    @classmethod
+    def buildUpsert(cls) -> Tuple[List[ColumnInfo], str]:
+        table = cls.getTableName()
+        cols = cls.columns
+        sql = f"INSERT INTO {table}({', '.join([c.name for c in cols])}) "
+        sql += "VALUES %s"
+        sql += f" ON CONFLICT ({', '.join([c.name for c in cls.pkColumns])}) "
+        if len(cls.regColumns) == 0:
+            sql += "DO NOTHING"
+        else:
+            sql += "DO UPDATE SET " + ", ".join(
+                [f"{c.name} = excluded.{c.name}" for c in cls.regColumns]
+            )
+        return (cols, sql)
 
+    # insert or update in one statement. Rows whose primary key is still to be
+    # generated can only be inserted.
     def upsert(self) -> None:
-        me = type(self).get(self.getPKTuple())
-        if me is None:
+        if any([v is None for v in self.getPKTuple()]):
             self.insert()
-        else:
-            self.update()
+            return
+        cls = type(self)
+        table = cls.getTableName()
+        cols, sql = cls.buildUpsert()
+        sql = sql.replace("%s", "(" + ", ".join(["%s"] * len(cols)) + ")", 1)
+        data = self.toTuple()
+        conn = cls.getConnection()
+        with connectionLock(conn):
+            with conn.cursor() as curs:
+                logQuery("upsert", table, sql, data)
+                curs.execute(sql, data)
+
+            self.writeThrough()
+
+            commitWrite(conn)
+
+    # insert many rows with multi row statements
+    @classmethod
+    def bulkInsert(cls: Type[T], objs: Sequence[T], pageSize: int = 1000) -> None:
+        if len(objs) == 0:
+            return
+        from psycopg2.extras import execute_values
+
+        table = cls.getTableName()
+        cols = cls.getNonGeneratedColumns()
+        sql = f"INSERT INTO {table}({', '.join([c.name for c in cols])}) VALUES %s"
+        rows = [obj.toInsertTuple() for obj in objs]
+        conn = cls.getConnection()
+        with connectionLock(conn):
+            with conn.cursor() as curs:
+                logQuery("bulkInsert", table, sql, [len(rows)])
+                execute_values(curs, sql, rows, page_size=pageSize)
+
+            for obj in objs:
+                obj.writeThrough()
+
+            commitWrite(conn)
+
+    # upsert many rows with multi row statements; every object needs its
+    # primary key set
+    @classmethod
+    def bulkUpsert(cls: Type[T], objs: Sequence[T], pageSize: int = 1000) -> None:
+        if len(objs) == 0:
+            return
+        from psycopg2.extras import execute_values
+
+        table = cls.getTableName()
+        cols, sql = cls.buildUpsert()
+        # a statement can't touch the same row twice, so the last object for
+        # each key wins
+        byKey: Dict[Tuple[Any, ...], Sequence[Any]] = {}
+        for obj in objs:
+            pkValues = tuple(obj.getPKTuple())
+            if any([v is None for v in pkValues]):
+                raise Exception(f"bulkUpsert: {table} row without primary key")
+            byKey[pkValues] = obj.toTuple()
+        rows = list(byKey.values())
+        conn = cls.getConnection()
+        with connectionLock(conn):
+            with conn.cursor() as curs:
+                logQuery("bulkUpsert", table, sql, [len(rows)])
+                execute_values(curs, sql, rows, page_size=pageSize)
+
+            for obj in objs:
+                obj.writeThrough()
+
+            commitWrite(conn)
 
     @classmethod
     def new(cls: Type[T]) -> T:
@@ -277,10 +684,7 @@ class StoreType:
             obj.__setattr__(cls.pkColumns[i].name, pkValues[i])
 
         obj.insert()
-        res = cls.get(pkValues)
-        if res is None:
-            raise Exception("unable to create")
-        return res
+        return obj
 
     @classmethod
     def getOrCreate(cls: Type[T], pkValues: Sequence[Any]) -> T:
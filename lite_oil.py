@@ -45,6 +45,12 @@ def commit() -> None:
         __conns[subDB].commit()
 
 
+def rollback() -> None:
+    global __conns
+    for subDB in __conns:
+        __conns[subDB].rollback()
+
+
 def shutdown() -> None:
     global __conns
     for subDB in list(__conns.keys()):
@@ -20,7 +20,7 @@ def fetch(url: str, pageNo: int, delay: int, force: bool = False) -> Optional[st
     url = url.format(pageNo)
     print(url)
 
-    mostRecent = scrape.getMostRecentScrape(url)
+    mostRecent = scrape.getMostRecentScrapeMeta(url)
     if mostRecent is not None and not force:
         print(f"url has already been scraped: {url}")
         return None
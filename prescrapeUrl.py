@@ -16,7 +16,7 @@ force = False
 if len(sys.argv) > 3 and sys.argv[3] == "force":
     force = True
 
-mostRecent = scrape.getMostRecentScrape(url)
+mostRecent = scrape.getMostRecentScrapeMeta(url)
 if mostRecent is not None and not force:
     print(f"url has already been scraped: {url}")
     sys.exit(0)
@@ -0,0 +1,129 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import random
+import threading
+import time
+
+from codec import getDomain
+import scrape
+
+# Plans a rescrape of a set of stale urls. The whole stale set is computed
+# once up front and grouped by domain. Domains are then dealt out to workers
+# so each domain belongs to exactly one worker; a worker cycles through its
+# domains, fetching from whichever is ready next, and keeps its own clock of
+# when each of its domains may be hit again. Workers never share a domain, so
+# no coordination (or polling of web for the last hit) is needed to stay
+# polite, and a slow or throttled domain only holds up its own urls.
+
+StaleUrl = Tuple[int, str]
+Plan = Dict[str, List[StaleUrl]]
+
+# extra wait after a failed fetch (429s in particular) before trying the
+# domain again
+failurePenalty = 60
+
+
+# run a query returning (id, url) rows and group them by domain. Urls within
+# a domain are shuffled so work is spread over the domain's stories.
+def planStale(sql: str, args: Sequence[Any]) -> Plan:
+    conn = scrape.openMinerva()
+    curs = conn.cursor()
+    curs.execute(sql, args)
+    plan: Plan = {}
+    for wid, url in curs.fetchall():
+        plan.setdefault(getDomain(url), []).append((int(wid), str(url)))
+    curs.close()
+    scrape.closeMinerva()
+    for urls in plan.values():
+        random.shuffle(urls)
+    return plan
+
+
+# split domains between workers, largest first onto the least loaded worker
+def shardDomains(plan: Plan, workers: int) -> List[Plan]:
+    shards: List[Plan] = [{} for _ in range(max(1, workers))]
+    loads = [0] * len(shards)
+    for domain in sorted(plan, key=lambda d: len(plan[d]), reverse=True):
+        i = loads.index(min(loads))
+        shards[i][domain] = plan[domain]
+        loads[i] += len(plan[domain])
+    return [s for s in shards if len(s) > 0]
+
+
+class RescrapeWorker:
+    def __init__(
+        self,
+        ident: int,
+        domains: Plan,
+        interval: Callable[[], float],
+        fetch: Callable[[str], None],
+        isStale: Optional[Callable[[str], bool]] = None,
+    ) -> None:
+        self.ident = ident
+        self.domains = {d: list(reversed(urls)) for d, urls in domains.items()}
+        self.interval = interval
+        self.fetch = fetch
+        self.isStale = isStale
+        # when each domain may next be hit
+        self.clock = {d: 0.0 for d in self.domains}
+        self.fetched = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def step(self) -> bool:
+        if len(self.domains) == 0:
+            return False
+        domain = min(self.clock, key=lambda d: self.clock[d])
+        wait = self.clock[domain] - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+        wid, url = self.domains[domain].pop()
+        if len(self.domains[domain]) == 0:
+            del self.domains[domain]
+            del self.clock[domain]
+
+        if self.isStale is not None and not self.isStale(url):
+            self.skipped += 1
+            return True  # rescraped since we planned
+
+        penalty = 0.0
+        print(f"[{self.ident}] refetching {wid}: {url}")
+        try:
+            self.fetch(url)
+            self.fetched += 1
+        except Exception as e:
+            print(f"[{self.ident}]   failed: {e}")
+            self.failed += 1
+            penalty = failurePenalty
+        if domain in self.clock:
+            self.clock[domain] = time.time() + self.interval() + penalty
+        return True
+
+    def run(self) -> None:
+        while self.step():
+            pass
+        print(
+            f"[{self.ident}] done: fetched {self.fetched}, skipped {self.skipped}"
+            + f", failed {self.failed}"
+        )
+
+
+# rescrape everything in plan using workers threads
+def run(
+    plan: Plan,
+    workers: int,
+    interval: Callable[[], float],
+    fetch: Callable[[str], None],
+    isStale: Optional[Callable[[str], bool]] = None,
+) -> None:
+    total = sum([len(urls) for urls in plan.values()])
+    shards = shardDomains(plan, workers)
+    print(f"planned {total} urls over {len(plan)} domains, {len(shards)} workers")
+    threads = []
+    for i, shard in enumerate(shards):
+        w = RescrapeWorker(i, shard, interval, fetch, isStale)
+        t = threading.Thread(target=w.run, name=f"rescrape-{i}")
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
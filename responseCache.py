@@ -0,0 +1,176 @@
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+from collections import OrderedDict
+import os
+import sys
+import threading
+import time
+
+# An in-process LRU of archive lookups so pages read several times in one run
+# (reader pages while parsing a thread, chapter 1 for both info and content)
+# only come out of postgres once. Entries are the dicts scrape.py hands out
+# and are charged by the length of their body; once over the limit the least
+# recently used are dropped.
+#
+# Bodies are cached by web id, which never changes. Lookups of "the most
+# recent scrape of url" are cached by url and their freshness bound (status
+# and beforeId) and are dropped whenever a new scrape of that url is saved.
+# Pattern lookups (url like or urlKey) could match any newly saved url, so
+# they are all dropped on any save. Other processes save scrapes too, so
+# everything but bodies (including lookups that found nothing) also expires
+# after maxAge seconds.
+#
+# HERMES_RESPONSE_CACHE_MB sets the size (default 64, 0 disables it),
+# HERMES_RESPONSE_CACHE_TTL the max age in seconds (default 300) and
+# HERMES_RESPONSE_CACHE_STATS prints hit/miss counts at exit.
+entryOverhead = 256
+defaultMaxAge = 300.0
+
+# cached value for a lookup that found nothing
+missing: Dict[str, Any] = {"missing": True}
+
+
+class ResponseCache:
+    def __init__(self, maxBytes: int, maxAge: float = defaultMaxAge) -> None:
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.bytes = 0
+        # key => (value, size, expiry time or None if it can't go stale)
+        self.entries: (
+            "OrderedDict[Hashable, Tuple[Dict[str, Any], int, Optional[float]]]"
+        ) = OrderedDict()
+        self.byUrl: Dict[str, Set[Hashable]] = {}
+        self.patterns: Set[Hashable] = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # bumped by every invalidate, so a lookup that raced with a save can
+        # tell its result may already be stale
+        self.generation = 0
+
+    @staticmethod
+    def entrySize(value: Dict[str, Any]) -> int:
+        raw = value.get("raw", None)
+        return entryOverhead + (0 if raw is None else len(raw))
+
+    # a copy of the cached value for key, missing if the lookup found nothing
+    # last time, or None if it isn't cached
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None and entry[2] is not None and entry[2] <= time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0] if entry[0] is missing else dict(entry[0])
+
+    # cache value for key. url is what a save has to invalidate it by, None
+    # for entries that can't go stale and pattern for lookups that any save
+    # may change; those, and lookups that found nothing, expire after maxAge.
+    # generation is self.generation from before the lookup was made; if
+    # anything was saved since, value is not cached.
+    def put(
+        self,
+        key: Hashable,
+        value: Optional[Dict[str, Any]],
+        url: Optional[str] = None,
+        pattern: bool = False,
+        generation: Optional[int] = None,
+    ) -> None:
+        if self.maxBytes <= 0:
+            return
+        value = missing if value is None else dict(value)
+        size = self.entrySize(value)
+        if size > self.maxBytes:
+            return
+        expires = None
+        if url is not None or pattern or value is missing:
+            if self.maxAge <= 0:
+                return
+            expires = time.time() + self.maxAge
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._remove(key)
+            self.entries[key] = (value, size, expires)
+            self.bytes += size
+            if pattern:
+                self.patterns.add(key)
+            elif url is not None:
+                self.byUrl.setdefault(url, set()).add(key)
+            while self.bytes > self.maxBytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry[1]
+        self.patterns.discard(key)
+        # keys of url lookups start with their url, see scrape.py
+        if isinstance(key, tuple) and len(key) > 1 and isinstance(key[1], str):
+            keys = self.byUrl.get(key[1], None)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.byUrl[key[1]]
+
+    # a new scrape of url was saved
+    def invalidate(self, url: str) -> None:
+        with self.lock:
+            self.generation += 1
+            if url not in self.byUrl and len(self.patterns) == 0:
+                return
+            for key in list(self.byUrl.get(url, set())) + list(self.patterns):
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.byUrl.clear()
+            self.patterns.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+            }
+
+
+_cache: Optional[ResponseCache] = None
+_cacheLock = threading.Lock()
+
+
+def getCache() -> ResponseCache:
+    global _cache
+    with _cacheLock:
+        if _cache is None:
+            mb = float(os.environ.get("HERMES_RESPONSE_CACHE_MB", "64"))
+            ttl = float(os.environ.get("HERMES_RESPONSE_CACHE_TTL", defaultMaxAge))
+            _cache = ResponseCache(int(mb * 1024 * 1024), ttl)
+        return _cache
+
+
+def printStats() -> None:
+    if _cache is None or "HERMES_RESPONSE_CACHE_STATS" not in os.environ:
+        return
+    s = _cache.stats()
+    lookups = s["hits"] + s["misses"]
+    rate = 0.0 if lookups == 0 else 100.0 * s["hits"] / lookups
+    print(
+        f"response cache: {s['hits']} hits, {s['misses']} misses ({rate:.1f}%),"
+        + f" {s['evictions']} evictions, {s['entries']} entries,"
+        + f" {s['bytes']} bytes",
+        file=sys.stderr,
+    )
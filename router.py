@@ -0,0 +1,113 @@
+import typing
+from typing import Dict, List, Optional, Tuple
+import re
+import threading
+
+from htypes import FicType, adapters
+
+if typing.TYPE_CHECKING:
+    from adapter.adapter import Adapter
+
+# Picks the adapter for a url. An adapter claims a url when any of its
+# urlFragments appears anywhere in it, and when several do the one registered
+# first wins. Calling url.find for every fragment of every adapter is the slow
+# part of resolving a url, so the router works from the host instead: the best
+# fragment found in a host is remembered, and the url then only has to be
+# checked (with one compiled regex) for fragments of adapters registered
+# before that one. Urls no fragment claims are ruled out by a single regex
+# over all fragments. Either way the result is the same as the scan.
+maxHosts = 16384
+
+
+def hostOf(url: str) -> str:
+    parts = url.split("/", 3)
+    return parts[2] if len(parts) > 2 else ""
+
+
+def compileFragments(fragments: List[str]) -> Optional["re.Pattern[str]"]:
+    if len(fragments) == 0:
+        return None
+    return re.compile("|".join([re.escape(f) for f in fragments]))
+
+
+class UrlRouter:
+    def __init__(self, registry: Dict[FicType, Optional["Adapter"]]) -> None:
+        # (FicType, fragment) in registry order
+        self.fragments: List[Tuple[FicType, str]] = []
+        for ftype, a in registry.items():
+            if a is None:
+                continue
+            for fragment in a.urlFragments:
+                self.fragments.append((ftype, fragment))
+        allFragments = [f for _, f in self.fragments]
+        self.anyFragment = compileFragments(allFragments)
+        # earlier[i] matches any fragment that would win over fragment i
+        self.earlier = [
+            compileFragments(allFragments[:i]) for i in range(len(allFragments))
+        ]
+        self.hosts: Dict[str, Optional[int]] = {}
+
+    # the index of the first fragment found in s, or None
+    def scan(self, s: str) -> Optional[int]:
+        for i, (_, fragment) in enumerate(self.fragments):
+            if s.find(fragment) != -1:
+                return i
+        return None
+
+    def hostFragment(self, host: str) -> Optional[int]:
+        hosts = self.hosts
+        if host in hosts:
+            return hosts[host]
+        if len(self.hosts) >= maxHosts:
+            self.hosts = {}
+        best = self.scan(host)
+        self.hosts[host] = best
+        return best
+
+    # the (FicType, fragment) that claims url, or (None, None)
+    def match(self, url: str) -> Tuple[Optional[FicType], Optional[str]]:
+        best = self.hostFragment(hostOf(url))
+        if best is not None:
+            earlier = self.earlier[best]
+            if earlier is not None and earlier.search(url) is not None:
+                best = self.scan(url)
+        elif self.anyFragment is not None and self.anyFragment.search(url) is not None:
+            best = self.scan(url)
+        if best is None:
+            return (None, None)
+        return self.fragments[best]
+
+
+_router: Optional[UrlRouter] = None
+_routerLock = threading.Lock()
+
+
+def getRouter() -> UrlRouter:
+    global _router
+    with _routerLock:
+        if _router is None:
+            _router = UrlRouter(dict(adapters))
+        return _router
+
+
+# drop the compiled router so the next lookup sees changes to htypes.adapters
+def reset() -> None:
+    global _router
+    with _routerLock:
+        _router = None
+
+
+def match(url: str) -> Tuple[Optional[FicType], Optional[str]]:
+    return getRouter().match(url)
+
+
+# the linear scan match replaced, kept for checking the router against
+def scanMatch(url: str) -> Tuple[Optional[FicType], Optional[str]]:
+    for ftype in adapters:
+        a = adapters[ftype]
+        if a is None:
+            continue
+        for fragment in a.urlFragments:
+            if url.find(fragment) != -1:
+                return (ftype, fragment)
+    return (None, None)
@@ -268,22 +268,32 @@ tables = [
         foreign key(ficId, localChapterId) references fic_chapter(ficId, localChapterId)
     """,
     ),
+    (
+        "work_queue",
+        """
+        id bigserial primary key,
+        kind text not null,
+        payload text not null,
+        priority int4 not null default(0),
+        status workStatus not null default('pending'),
+        tries int4 not null default(0),
+        maxTries int4 not null default(5),
+        visibleAt int8 not null default(0),
+        leasedBy varchar(128) null,
+        created oil_timestamp not null default(oil_timestamp()),
+        finished oil_timestamp null,
+        lastError text null
+    """,
+    ),
 ]
 
 enums = {
     "ficStatus": ("broken", "abandoned", "ongoing", "complete"),
     "importStatus": ("pending", "metadata", "content", "deep"),
     "tag_type": ("tag", "genre", "fandom", "character"),
+    "workStatus": ("pending", "leased", "done", "failed"),
 }
 
-# importQueueTable = '''CREATE TABLE `import_queue` (
-# `ident` TEXT PRIMARY KEY NOT NULL,
-# `added` INT NOT NULL,
-# `touched` INT NULL,
-# `tries` INT NOT NULL,
-# `status` INT NOT NULL
-# );'''
-
 entities: Dict[str, Any] = {
     "tables": tables,
     "enums": enums,
@@ -452,6 +462,11 @@ class ColumnInfo:
             + f"{self.notnull}, {self.dflt_value}, {self.pk}, {repr(self.ptype)})"
         )
 
+    # filled in by the database (serials), left out of inserts and read back
+    # from their RETURNING
+    def isGenerated(self) -> bool:
+        return self.type.lower().find("serial") >= 0
+
     def __str__(self) -> str:
         return str(self.__dict__)
 
@@ -539,6 +554,11 @@ def writeColumnInfo(f: IO, clsName: str, columns: List[ColumnInfo]) -> None:
     f.write("        " + ",".join([f"columns[{cid}]" for cid in regColumnIds]))
     f.write("\n    ]\n")
 
+    genColumnIds = [ci.cid for ci in columns if ci.isGenerated()]
+    f.write("    generatedColumns: List[ColumnInfo] = [\n")
+    f.write("        " + ",".join([f"columns[{cid}]" for cid in genColumnIds]))
+    f.write("\n    ]\n")
+
     f.write("    fields = {")
     f.write(",".join([repr(ci.name) for ci in columns]))
     f.write("}\n")
@@ -600,7 +620,7 @@ def writeToTuple(f: IO, clsName: str, columns: List[ColumnInfo]) -> None:
 
 
 def writeToInsertTuple(f: IO, clsName: str, columns: List[ColumnInfo]) -> None:
-    columns = [c for c in columns if c.type.lower().find("serial") < 0]
+    columns = [c for c in columns if not c.isGenerated()]
     tupleTypes = ", ".join([ci.ptype for ci in columns])
     memberNames = ", ".join([f"self.{ci.name}" for ci in columns])
     f.writelines(
@@ -1,23 +1,48 @@
 import typing
-from typing import Any, Dict, List, Optional, Sequence, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import atexit
 import contextlib
+import hashlib
 import os
 import random
+import re
 import sys
+import threading
 import time
 import traceback
 
+import fetch
 import lite_oil
+import responseCache
+import segment
 import util
 
 if typing.TYPE_CHECKING:
-    from psycopg2 import connection  # type: ignore[attr-defined]
+    from psycopg2 import connection, cursor  # type: ignore[attr-defined]
     import requests
 
 __scrapeSource: Optional[str] = None
 
-__oilConn = None
-__oilCurs = None
+# one persistent connection per thread, closed by shutdownMinerva at exit
+__oilConns: Dict[int, "connection"] = {}
+__oilLock = threading.Lock()
+
+# pending saveWebRequest rows while batching, see batchWebWrites
+_webBatchSize = 0
+# (created, url, status, response, source, responseHash, etag, lastModified)
+_webBatch: List[
+    Tuple[
+        int,
+        str,
+        int,
+        Optional[str],
+        Optional[str],
+        Optional[bytes],
+        Optional[str],
+        Optional[str],
+    ]
+] = []
+_webBatchLock = threading.Lock()
 
 __userAgent = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.93 Safari/537.36"
 
@@ -25,19 +50,36 @@ decodeFailureDumpFile = "/tmp/hermes_decodeFailure.html"
 
 _staleOnly = False
 _staleBefore = None
+_forceRefresh = False
+
+# sites whose story urls carry a cosmetic title after /s/{storyId}/{chapterId}
+titledStoryHosts = {"fanfiction.net", "fictionpress.com"}
+xenForoThreadRe = re.compile("((?:^|[/?])threads/)[^/?#]*\\.(\\d+)")
 
 utf8_to_cp1252: List[Tuple[bytes, bytes]] = []
 cp1252_munge: List[Tuple[bytes, bytes]] = []
 
+# single pass forms of the above, built by setupCP1252
+utf8_to_cp1252_re: Optional["re.Pattern[bytes]"] = None
+utf8_to_cp1252_map: Dict[bytes, bytes] = {}
+cp1252_munge_table = bytes(range(256))
+cp1252_munge_delete = b""
+
 
 def importEnvironment() -> None:
     global _staleOnly, _staleBefore
     if "HERMES_STALE" in os.environ:
         _staleOnly = True
+    if "HERMES_SEGMENTS_ONLY" in os.environ:
+        _staleOnly = True
     if "HERMES_STALE_BEFORE" in os.environ:
         _staleBefore = int(os.environ["HERMES_STALE_BEFORE"])
         _staleOnly = True
 
+    global _forceRefresh
+    if "HERMES_FORCE_REFRESH" in os.environ:
+        _forceRefresh = True
+
     global __scrapeSource
     __scrapeSource = (
         __scrapeSource
@@ -45,57 +87,264 @@ def importEnvironment() -> None:
         else os.environ["OIL_SCRAPE_SOURCE"]
     )
 
+    global _webBatchSize
+    if "HERMES_WEB_BATCH" in os.environ:
+        _webBatchSize = int(os.environ["HERMES_WEB_BATCH"])
 
-def openMinerva() -> "connection":
-    global __oilConn
-    if __oilConn is None:
+
+def _minervaConnection() -> "connection":
+    if segment.segmentsOnly():
+        raise Exception("minerva web tables are not used with HERMES_SEGMENTS_ONLY")
+    tid = threading.get_ident()
+    conn = __oilConns.get(tid)
+    if conn is None or conn.closed:
         import psycopg2
 
-        __oilConn = psycopg2.connect(lite_oil.getConnectionString())
-        if __oilConn is None:
-            raise Exception("__oilConn")
-    return __oilConn
+        conn = psycopg2.connect(lite_oil.getConnectionString())
+        with __oilLock:
+            __oilConns[tid] = conn
+    return conn
+
 
+# get this thread's minerva connection. Any batched writes are flushed first
+# so reads always see them.
+def openMinerva() -> "connection":
+    if len(_webBatch) > 0:
+        flushWebWrites()
+    return _minervaConnection()
 
+
+# finish the current unit of work; the connection stays open for reuse
 def closeMinerva() -> None:
-    global __oilConn
-    if __oilConn is None:
+    conn = __oilConns.get(threading.get_ident())
+    if conn is None or conn.closed:
         return
-    __oilConn.commit()
-    __oilConn.close()
-    __oilConn = None
+    conn.commit()
+
+
+def shutdownMinerva() -> None:
+    flushWebWrites()
+    with __oilLock:
+        conns = list(__oilConns.values())
+        __oilConns.clear()
+    for conn in conns:
+        if conn.closed:
+            continue
+        conn.commit()
+        conn.close()
+
+
+atexit.register(shutdownMinerva)
+atexit.register(responseCache.printStats)
+
+
+# compute the normalized lookup key stored in web.urlKey: the url without
+# protocol, leading www., fragment, or any cosmetic title that doesn't change
+# which page is being fetched. All the ways of spelling the same page share a
+# key, so lookups can use idx_web_url_key instead of leading wildcard likes.
+def urlKey(url: str) -> str:
+    rest = url[url.find("://") + 3 :] if url.find("://") >= 0 else url
+    if rest.find("#") >= 0:
+        rest = rest[: rest.find("#")]
+    slash = rest.find("/")
+    host, path = (rest, "") if slash < 0 else (rest[:slash], rest[slash:])
+    host = host.lower()
+    if host.startswith("www."):
+        host = host[len("www.") :]
+
+    if ".".join(host.split(".")[-2:]) in titledStoryHosts:
+        parts = path.split("/")
+        if len(parts) > 4 and parts[1] == "s":
+            path = "/".join(parts[:4])
+    else:
+        # xenforo: threads/some-title.12345/reader => threads/12345/reader
+        path = xenForoThreadRe.sub("\\1\\2", path, count=1)
+
+    return host + path
+
+
+def likeEscape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+# the literal string a like pattern matches, or None if it has wildcards
+def likeLiteral(like: str) -> Optional[str]:
+    res = ""
+    escaped = False
+    for c in like:
+        if escaped:
+            res += c
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c in "%_":
+            return None
+        else:
+            res += c
+    return res
+
+
+# segment archives can only answer exact lookups; anything else is a miss
+def getLastArchivedUrl(like: str, key: bool) -> Optional[str]:
+    literal = likeLiteral(like)
+    archive = segment.getArchive()
+    if literal is None or archive is None:
+        return None
+    r = archive.find(None if key else literal, literal if key else None)
+    return None if r is None else r[1][4]
+
+
+def hashWebResponse(raw: bytes) -> bytes:
+    return hashlib.sha256(raw).digest()
+
+
+# store a response body in web_blob if it isn't already there, returning the
+# content hash web rows should reference
+def saveWebBlob(curs: "cursor", raw: bytes, url: Optional[str] = None) -> bytes:
+    responseHash = hashWebResponse(raw)
+    curs.execute("select 1 from web_blob where hash = %s", (responseHash,))
+    if curs.fetchone() is None:
+        curs.execute(
+            (
+                "insert into web_blob(hash, response) values(%s, %s)"
+                + " on conflict (hash) do nothing"
+            ),
+            (responseHash, util.compress(raw, url)),
+        )
+    return responseHash
 
 
+# record a fetch of url. Either the response text is given, or for a
+# revalidated response (see scrape) the responseHash of the unchanged body.
+# etag and lastModified are the validators to send on the next fetch.
 def saveWebRequest(
     created: int,
     url: str,
     status: int,
     response: Optional[str],
     source: Optional[str] = None,
+    responseHash: Optional[bytes] = None,
+    etag: Optional[str] = None,
+    lastModified: Optional[str] = None,
 ) -> None:
-    # import psycopg2
-    responseBytes: Optional[bytes] = None
-    if response is not None:
-        responseBytes = util.compress(response.encode("utf-8"))
-
     global __scrapeSource
     if source is None:
         source = __scrapeSource
-    conn = openMinerva()
+
+    # skitter lookups are cached by canonical url
+    responseCache.getCache().invalidate(url)
+    if canonizeUrl(url) != url:
+        responseCache.getCache().invalidate(canonizeUrl(url))
+    if _webBatchSize > 0:
+        with _webBatchLock:
+            _webBatch.append(
+                (
+                    created,
+                    url,
+                    status,
+                    response,
+                    source,
+                    responseHash,
+                    etag,
+                    lastModified,
+                )
+            )
+            full = len(_webBatch) >= _webBatchSize
+        if full:
+            flushWebWrites()
+        return
+
+    conn = _minervaConnection()
 
     curs = conn.cursor()
+    if response is not None:
+        responseHash = saveWebBlob(curs, response.encode("utf-8"), url)
+
     curs.execute(
         (
-            "insert into web(created, url, status, response, source)"
-            + "values(%s, %s, %s, %s, %s)"
+            "insert into web(created, url, urlKey, status, responseHash, source,"
+            + " etag, lastModified) values(%s, %s, %s, %s, %s, %s, %s, %s)"
+        ),
+        (
+            created,
+            url,
+            urlKey(url),
+            status,
+            responseHash,
+            source,
+            etag,
+            lastModified,
         ),
-        (created, url, status, responseBytes, source),
     )
 
     curs.close()
     closeMinerva()
 
 
+# write out any rows queued by saveWebRequest while batching. Bodies already
+# in web_blob are skipped before compressing, the rest go in with one multi
+# row insert per table.
+def flushWebWrites() -> None:
+    with _webBatchLock:
+        batch = list(_webBatch)
+        _webBatch.clear()
+    if len(batch) == 0:
+        return
+
+    from psycopg2.extras import execute_values
+
+    bodies: Dict[bytes, Tuple[bytes, str]] = {}
+    rows: List[Tuple[Any, ...]] = []
+    for created, url, status, response, source, rhash, etag, lastMod in batch:
+        responseHash = rhash
+        if response is not None:
+            raw = response.encode("utf-8")
+            responseHash = hashWebResponse(raw)
+            bodies.setdefault(responseHash, (raw, url))
+        rows.append(
+            (created, url, urlKey(url), status, responseHash, source, etag, lastMod)
+        )
+
+    conn = _minervaConnection()
+    curs = conn.cursor()
+    if len(bodies) > 0:
+        curs.execute(
+            "select hash from web_blob where hash = any(%s)", (list(bodies.keys()),)
+        )
+        for r in curs.fetchall():
+            bodies.pop(r[0].tobytes(), None)
+    if len(bodies) > 0:
+        execute_values(
+            curs,
+            "insert into web_blob(hash, response) values %s"
+            + " on conflict (hash) do nothing",
+            [(h, util.compress(raw, url)) for h, (raw, url) in bodies.items()],
+        )
+    execute_values(
+        curs,
+        "insert into web(created, url, urlKey, status, responseHash, source,"
+        + " etag, lastModified) values %s",
+        rows,
+    )
+    curs.close()
+    conn.commit()
+
+
+# queue saveWebRequest rows and write them batchSize at a time instead of one
+# round trip (and commit) each. Everything is flushed when the block exits,
+# before any read through openMinerva, and at process exit.
+@contextlib.contextmanager
+def batchWebWrites(batchSize: int = 500) -> Iterator[None]:
+    global _webBatchSize
+    prevSize = _webBatchSize
+    _webBatchSize = batchSize
+    try:
+        yield
+    finally:
+        _webBatchSize = prevSize
+        flushWebWrites()
+
+
 def getAllUrlLike(like: str) -> List[str]:
     conn = openMinerva()
     curs = conn.cursor()
@@ -114,6 +363,8 @@ def getAllUrlLike(like: str) -> List[str]:
 
 
 def getLastUrlLike(like: str) -> Optional[str]:
+    if segment.segmentsOnly():
+        return getLastArchivedUrl(like, key=False)
     conn = openMinerva()
     curs = conn.cursor()
     stmt = """
@@ -133,6 +384,35 @@ def getLastUrlLike(like: str) -> Optional[str]:
     return str(res[0])
 
 
+# find the most recently fetched url with the given urlKey
+def getLastUrlForKey(key: str) -> Optional[str]:
+    return getLastUrlForKeyLike(likeEscape(key))
+
+
+# like getLastUrlLike, but matches against urlKey; keyLike should be anchored
+# at the start so idx_web_url_key can be used
+def getLastUrlForKeyLike(keyLike: str) -> Optional[str]:
+    if segment.segmentsOnly():
+        return getLastArchivedUrl(keyLike, key=True)
+    conn = openMinerva()
+    curs = conn.cursor()
+    stmt = """
+        select url from web
+        where status = 200
+            and urlKey like %s
+        order by created desc
+        limit 1
+    """
+
+    curs.execute(stmt, (keyLike,))
+    res = curs.fetchone()
+
+    curs.close()
+    if res is None:
+        return None
+    return str(res[0])
+
+
 # takes a tuple with the first being an actual url
 def getLastUrlLikeOrDefault(defaultAndLikes: Sequence[str]) -> str:
     conn = openMinerva()
@@ -159,46 +439,245 @@ def getLastUrlLikeOrDefault(defaultAndLikes: Sequence[str]) -> str:
 ScrapeMeta = Dict[str, Any]
 
 
-def getMostRecentScrapeWithMeta(
+def _mostRecentScrapeWhere(
     url: str,
-    ulike: Optional[str] = None,
-    status: Optional[int] = 200,
-    beforeId: Optional[int] = None,
-) -> Optional[ScrapeMeta]:
-    conn = openMinerva()
-    curs = conn.cursor()
-    stmt = "select id, created, url, response, status from web where "
+    ulike: Optional[str],
+    status: Optional[int],
+    beforeId: Optional[int],
+    ukey: Optional[str],
+) -> Tuple[str, List[Any]]:
     clauses: List[str] = []
     whereData: List[Any] = []
     if status is not None:
-        clauses += ["status = %s"]
+        clauses += ["w.status = %s"]
         whereData += [status]
     if beforeId is not None:
-        clauses += ["id <= %s"]
+        clauses += ["w.id <= %s"]
         whereData += [beforeId]
 
-    if ulike is None:
-        clauses += ["url = %s"]
+    if ukey is not None:
+        clauses += ["w.urlKey = %s"]
+        whereData += [ukey]
+    elif ulike is None:
+        clauses += ["w.url = %s"]
         whereData += [url]
     else:
-        clauses += ["url like %s"]
+        clauses += ["w.url like %s"]
         whereData += [ulike]
 
-    stmt += " and ".join(clauses)
-    stmt += " order by id desc"
+    return (" and ".join(clauses), whereData)
+
+
+# lookups of the most recent scrape are remembered in responseCache without
+# their body (see _cacheBody), keyed by everything that goes into the where
+def _metaKey(
+    url: str,
+    ulike: Optional[str],
+    status: Optional[int],
+    beforeId: Optional[int],
+    ukey: Optional[str],
+) -> Tuple[Any, ...]:
+    return ("meta", url, ulike, status, beforeId, ukey)
+
+
+# (True, meta) if the lookup for key is cached, (False, None) if not
+def _cachedMeta(key: Tuple[Any, ...]) -> Tuple[bool, Optional[ScrapeMeta]]:
+    meta = responseCache.getCache().get(key)
+    if meta is None:
+        return (False, None)
+    if meta is responseCache.missing:
+        return (True, None)
+    return (True, meta)
+
+
+def _cacheMeta(
+    key: Tuple[Any, ...], meta: Optional[ScrapeMeta], generation: int
+) -> None:
+    if meta is not None:
+        meta = {k: v for k, v in meta.items() if k != "raw"}
+    pattern = key[2] is not None or key[5] is not None
+    responseCache.getCache().put(key, meta, key[1], pattern, generation)
+
+
+# bodies never change once saved, so they're cached by web id alone
+def _cachedBody(meta: ScrapeMeta) -> bool:
+    body = responseCache.getCache().get(("body", meta["id"]))
+    if body is None:
+        return False
+    meta["raw"] = body["raw"]
+    return True
+
+
+def _cacheBody(meta: ScrapeMeta) -> None:
+    responseCache.getCache().put(("body", meta["id"]), {"raw": meta["raw"]})
+
+
+# look up the most recent scrape without reading its body; the result has no
+# "raw" key, use loadScrapeBody to fill it in if it turns out to be needed
+def getMostRecentScrapeMeta(
+    url: str,
+    ulike: Optional[str] = None,
+    status: Optional[int] = 200,
+    beforeId: Optional[int] = None,
+    ukey: Optional[str] = None,
+) -> Optional[ScrapeMeta]:
+    key = _metaKey(url, ulike, status, beforeId, ukey)
+    hit, meta = _cachedMeta(key)
+    if hit:
+        return meta
+    generation = responseCache.getCache().generation
+    meta = _getMostRecentScrapeMeta(url, ulike, status, beforeId, ukey)
+    _cacheMeta(key, meta, generation)
+    return meta
+
+
+def _getMostRecentScrapeMeta(
+    url: str,
+    ulike: Optional[str],
+    status: Optional[int],
+    beforeId: Optional[int],
+    ukey: Optional[str],
+) -> Optional[ScrapeMeta]:
+    if segment.segmentsOnly():
+        return getArchivedScrapeMeta(url, ulike, status, beforeId, ukey)
+    conn = openMinerva()
+    curs = conn.cursor()
+    where, whereData = _mostRecentScrapeWhere(url, ulike, status, beforeId, ukey)
+    stmt = "select w.id, w.created, w.url, w.status from web w where "
+    stmt += where
+    stmt += " order by w.id desc limit 1"
 
     curs.execute(stmt, tuple(whereData))
     res = curs.fetchone()
 
     curs.close()
     if res is None:
+        return getArchivedScrapeMeta(url, ulike, status, beforeId, ukey)
+    return {"id": res[0], "url": res[2], "fetched": res[1], "status": res[3]}
+
+
+# look for a scrape that has been moved out of postgres into the segment
+# archive (see segment.py and webArchive.py archive). Only exact url and
+# urlKey lookups can be answered from segments.
+def getArchivedScrapeMeta(
+    url: str,
+    ulike: Optional[str] = None,
+    status: Optional[int] = 200,
+    beforeId: Optional[int] = None,
+    ukey: Optional[str] = None,
+) -> Optional[ScrapeMeta]:
+    if ukey is None and ulike is not None:
+        return None
+    archive = segment.getArchive()
+    if archive is None:
+        return None
+    r = archive.find(url if ukey is None else None, ukey, status, beforeId)
+    if r is None:
         return None
+    seg, (wid, offset, created, rstatus, rurl) = r
+    return {
+        "id": wid,
+        "url": rurl,
+        "fetched": created,
+        "status": rstatus,
+        "segment": (seg.path, offset),
+    }
+
+
+# fetch and inflate the body for a result of getMostRecentScrapeMeta
+def loadScrapeBody(meta: ScrapeMeta) -> ScrapeMeta:
+    if "raw" in meta or _cachedBody(meta):
+        return meta
+    _loadScrapeBody(meta)
+    _cacheBody(meta)
+    return meta
+
+
+def _loadScrapeBody(meta: ScrapeMeta) -> None:
+    if "segment" in meta:
+        archive = segment.getArchive()
+        if archive is None:
+            raise Exception(f"segment archive went away: {meta['segment']}")
+        body = archive.read(*meta["segment"])[5]
+        meta["raw"] = None if body is None else util.decompress(body).decode("utf-8")
+        return
+    conn = openMinerva()
+    curs = conn.cursor()
+    stmt = """
+        select coalesce(b.response, w.response)
+        from web w
+        left join web_blob b on b.hash = w.responseHash
+        where w.id = %s"""
+
+    curs.execute(stmt, (meta["id"],))
+    res = curs.fetchone()
+
+    curs.close()
+    response = None if res is None else res[0]
+    if response is not None:
+        response = util.decompress(response.tobytes()).decode("utf-8")
+    meta["raw"] = response
+
+
+def getMostRecentScrapeWithMeta(
+    url: str,
+    ulike: Optional[str] = None,
+    status: Optional[int] = 200,
+    beforeId: Optional[int] = None,
+    ukey: Optional[str] = None,
+) -> Optional[ScrapeMeta]:
+    key = _metaKey(url, ulike, status, beforeId, ukey)
+    hit, meta = _cachedMeta(key)
+    if hit:
+        return None if meta is None else loadScrapeBody(meta)
+    generation = responseCache.getCache().generation
+    meta = _getMostRecentScrapeWithMeta(url, ulike, status, beforeId, ukey)
+    _cacheMeta(key, meta, generation)
+    if meta is not None:
+        _cacheBody(meta)
+    return meta
+
+
+def _getMostRecentScrapeWithMeta(
+    url: str,
+    ulike: Optional[str],
+    status: Optional[int],
+    beforeId: Optional[int],
+    ukey: Optional[str],
+) -> Optional[ScrapeMeta]:
+    if segment.segmentsOnly():
+        archived = getArchivedScrapeMeta(url, ulike, status, beforeId, ukey)
+        return None if archived is None else loadScrapeBody(archived)
+    conn = openMinerva()
+    curs = conn.cursor()
+    where, whereData = _mostRecentScrapeWhere(url, ulike, status, beforeId, ukey)
+    stmt = """
+        select w.id, w.created, w.url, coalesce(b.response, w.response), w.status
+        from web w
+        left join web_blob b on b.hash = w.responseHash
+        where """
+    stmt += where
+    stmt += " order by w.id desc limit 1"
+
+    curs.execute(stmt, tuple(whereData))
+    res = curs.fetchone()
+
+    curs.close()
+    if res is None:
+        archived = getArchivedScrapeMeta(url, ulike, status, beforeId, ukey)
+        return None if archived is None else loadScrapeBody(archived)
 
     response = res[3]
     if response is not None:
         response = util.decompress(response.tobytes()).decode("utf-8")
 
-    return {"url": res[2], "fetched": res[1], "raw": response, "status": res[4]}
+    return {
+        "id": res[0],
+        "url": res[2],
+        "fetched": res[1],
+        "raw": response,
+        "status": res[4],
+    }
 
 
 def getMostRecentScrape(url: str, ulike: Optional[str] = None) -> Optional[str]:
@@ -207,19 +686,122 @@ def getMostRecentScrape(url: str, ulike: Optional[str] = None) -> Optional[str]:
 
 
 def getMostRecentScrapeTime(url: str) -> Optional[int]:
+    r = getMostRecentScrapeMeta(url)
+    return None if r is None else int(r["fetched"])
+
+
+# the (id, responseHash, etag, lastModified) of the most recent successful
+# fetch of url if it can be revalidated with a conditional request
+def getValidators(
+    url: str,
+) -> Optional[Tuple[int, bytes, Optional[str], Optional[str]]]:
     conn = openMinerva()
     curs = conn.cursor()
-    stmt = "select created from web where status = 200 "
-    stmt += " and url = %s"
-    stmt += " order by id desc"
+    stmt = """
+        select id, responseHash, etag, lastModified from web
+        where status = 200 and url = %s
+        order by id desc
+        limit 1
+    """
 
     curs.execute(stmt, (url,))
     res = curs.fetchone()
 
+    curs.close()
+    if res is None or res[1] is None or (res[2] is None and res[3] is None):
+        return None
+    return (int(res[0]), res[1].tobytes(), res[2], res[3])
+
+
+# Urls that failed to fetch are kept in web_negative and not fetched again
+# until their backoff passes. Each consecutive failure doubles the wait, from
+# the first value up to the second, both in seconds.
+negativeBackoff: Dict[int, Tuple[int, int]] = {
+    403: (60 * 60, 7 * 24 * 60 * 60),
+    404: (6 * 60 * 60, 30 * 24 * 60 * 60),
+    410: (24 * 60 * 60, 90 * 24 * 60 * 60),
+    429: (5 * 60, 6 * 60 * 60),
+    503: (5 * 60, 6 * 60 * 60),
+}
+defaultNegativeBackoff = (30 * 60, 24 * 60 * 60)
+
+
+def negativeBackoffFor(status: int, failures: int) -> int:
+    base, limit = negativeBackoff.get(status, defaultNegativeBackoff)
+    return int(min(limit, base * 2 ** min(32, max(0, failures - 1))))
+
+
+# the (status, failures, retryAfter) recorded for url, if any
+def getNegative(url: str) -> Optional[Tuple[int, int, int]]:
+    conn = openMinerva()
+    curs = conn.cursor()
+    curs.execute(
+        "select status, failures, retryAfter from web_negative where url = %s",
+        (url,),
+    )
+    res = curs.fetchone()
     curs.close()
     if res is None:
         return None
-    return int(res[0])
+    return (int(res[0]), int(res[1]), int(res[2]))
+
+
+# note a failed fetch of url. retryAfter is the server's Retry-After in
+# seconds, which is used instead of the backoff when it's longer.
+def recordNegative(url: str, status: int, retryAfter: Optional[int] = None) -> None:
+    now = int(time.time())
+    prev = getNegative(url)
+    failures = 1 if prev is None or prev[0] != status else prev[1] + 1
+    wait = negativeBackoffFor(status, failures)
+    if retryAfter is not None:
+        wait = max(wait, retryAfter)
+    conn = openMinerva()
+    curs = conn.cursor()
+    curs.execute(
+        """
+        insert into web_negative(url, status, failures, lastFailure, retryAfter)
+        values(%s, %s, %s, %s, %s)
+        on conflict(url) do update set status = excluded.status,
+            failures = excluded.failures, lastFailure = excluded.lastFailure,
+            retryAfter = excluded.retryAfter
+    """,
+        (url, status, failures, now, now + wait),
+    )
+    curs.close()
+    closeMinerva()
+
+
+def clearNegative(url: str) -> None:
+    conn = openMinerva()
+    curs = conn.cursor()
+    curs.execute("delete from web_negative where url = %s", (url,))
+    curs.close()
+    closeMinerva()
+
+
+# the entry for url if it's still backing off
+def activeNegative(url: str) -> Optional[Tuple[int, int, int]]:
+    neg = getNegative(url)
+    if neg is None or neg[2] <= int(time.time()):
+        return None
+    return neg
+
+
+# raise if url is still backing off from a failed fetch, otherwise return its
+# entry (if any) so a successful fetch can clear it. Forced refreshes (force
+# or HERMES_FORCE_REFRESH) are always let through.
+def checkNegative(url: str, force: bool = False) -> Optional[Tuple[int, int, int]]:
+    neg = getNegative(url)
+    if neg is None or force or _forceRefresh or neg[2] <= int(time.time()):
+        return neg
+    util.logMessage(f"scrape|negative|{neg[0]}|{neg[2]}|{url}", "scrape.log")
+    raise Exception(f"failed to download url {neg[0]}: {url}")
+
+
+def parseRetryAfter(value: Optional[str]) -> Optional[int]:
+    if value is None or not value.strip().isnumeric():
+        return None
+    return int(value.strip())
 
 
 def canonizeUrl(url: str) -> str:
@@ -238,21 +820,21 @@ def softScrapeWithMeta(
     ulike: Optional[str] = None,
     mustyThreshold: Optional[int] = None,
     timeout: int = 15,
+    ukey: Optional[str] = None,
 ) -> Optional[ScrapeMeta]:
     url = canonizeUrl(url)
-    mostRecent = getMostRecentScrapeWithMeta(url, ulike, beforeId=_staleBefore)
+    # check freshness before paying for the body, a musty copy is thrown away
+    mostRecent = getMostRecentScrapeMeta(url, ulike, beforeId=_staleBefore, ukey=ukey)
     if (
         mostRecent is not None
         and mustyThreshold is not None
         and int(time.time()) - mustyThreshold > mostRecent["fetched"]
     ):
         mostRecent = None
-        time.sleep(1)
     if mostRecent is None:
-        scrape(url, delay=0.1, timeout=timeout)
-        mostRecent = getMostRecentScrapeWithMeta(url)
-        time.sleep(delay)
-    return mostRecent
+        scrape(url, delay=delay, timeout=timeout)
+        return getMostRecentScrapeWithMeta(url)
+    return loadScrapeBody(mostRecent)
 
 
 def softScrape(
@@ -261,9 +843,15 @@ def softScrape(
     ulike: Optional[str] = None,
     mustyThreshold: Optional[int] = None,
     timeout: int = 15,
+    ukey: Optional[str] = None,
 ) -> Optional[str]:
     r = softScrapeWithMeta(
-        url, delay=delay, ulike=ulike, mustyThreshold=mustyThreshold, timeout=timeout
+        url,
+        delay=delay,
+        ulike=ulike,
+        mustyThreshold=mustyThreshold,
+        timeout=timeout,
+        ukey=ukey,
     )
     return None if r is None else r["raw"]
 
@@ -301,6 +889,39 @@ def setupCP1252() -> None:
         (b"\xa0", b" "),  # nbsp
         (b"\xad", b""),  # soft hyphen
     ]
+    buildCP1252Repair()
+
+
+# Applying each utf8_to_cp1252 replace in order is the same as one regex
+# substitution over all of their patterns, except where an earlier
+# replacement creates a match for a later one (\xc3\xc2\xa9 becomes \xc3\xa9
+# and then \xe9). Those combinations are added as patterns of their own. Every
+# cp1252_munge entry is a single byte, so together they are one translate.
+def buildCP1252Repair() -> None:
+    global utf8_to_cp1252_re, utf8_to_cp1252_map
+    global cp1252_munge_table, cp1252_munge_delete
+    utf8_to_cp1252_map = dict(utf8_to_cp1252)
+    for i, (ikey, ival) in enumerate(utf8_to_cp1252):
+        for jkey, jval in utf8_to_cp1252[i + 1 :]:
+            start = jkey.find(ival)
+            while start >= 0:
+                combined = jkey[:start] + ikey + jkey[start + len(ival) :]
+                utf8_to_cp1252_map.setdefault(combined, jval)
+                start = jkey.find(ival, start + 1)
+    keys = sorted(utf8_to_cp1252_map, key=len, reverse=True)
+    utf8_to_cp1252_re = re.compile(b"|".join([re.escape(k) for k in keys]))
+
+    table = bytearray(range(256))
+    delete = b""
+    for src, dst in cp1252_munge:
+        if len(src) != 1 or len(dst) > 1:
+            raise Exception(f"cp1252_munge entries must be single bytes: {src!r}")
+        if len(dst) == 0:
+            delete += src
+        else:
+            table[src[0]] = dst[0]
+    cp1252_munge_table = bytes(table)
+    cp1252_munge_delete = delete
 
 
 def decodeRequest(data: Optional[bytes], url: str) -> Optional[str]:
@@ -333,13 +954,12 @@ def decodeRequest(data: Optional[bytes], url: str) -> Optional[str]:
 
     # replace misencoded utf-8 bits (likely from a header or footer) with their
     # cp1252 counterparts
-    for utoc in utf8_to_cp1252:
-        data = data.replace(utoc[0], utoc[1])
+    assert utf8_to_cp1252_re is not None
+    data = utf8_to_cp1252_re.sub(lambda m: utf8_to_cp1252_map[m.group(0)], data)
 
     # do some cleanup on the remaining cp1252 to normalize smart quotes and
     # delete a few invalid chars that may have leaked through
-    for ctom in cp1252_munge:
-        data = data.replace(ctom[0], ctom[1])
+    data = data.translate(cp1252_munge_table, cp1252_munge_delete)
 
     try:
         return data.decode("cp1252")
@@ -353,15 +973,9 @@ def decodeRequest(data: Optional[bytes], url: str) -> Optional[str]:
 def resolveRedirects(
     url: str, cookies: Optional["requests.cookies.RequestsCookieJar"] = None
 ) -> str:
-    import requests
-
     url = canonizeUrl(url)
     headers = {"User-Agent": __userAgent}
-    if cookies is None:
-        import priv
-
-        cookies = priv.getDefaultCookies()
-    r = requests.get(url, headers=headers, cookies=cookies, timeout=15)
+    r = fetch.sessionGet(url, headers, cookies, timeout=15)
     time.sleep(2 * random.random())
     return r.url
 
@@ -381,6 +995,8 @@ def scrape(
     cookies: Optional["requests.cookies.RequestsCookieJar"] = None,
     delay: float = 3,
     timeout: int = 15,
+    revalidate: bool = False,
+    force: bool = False,
 ) -> ScrapeMeta:
     url = canonizeUrl(url)
     headers = {"User-Agent": __userAgent}
@@ -394,29 +1010,62 @@ def scrape(
             raise Exception(f"failed to stale scrape url: {url}")
         return {"url": url, "fetched": ts, "raw": last["raw"]}
 
-    import requests
+    # don't refetch urls that recently failed until their backoff passes
+    negative = checkNegative(url, force)
 
-    if cookies is None:
-        import priv
+    # if asked, send the validators from the last fetch so an unchanged page
+    # comes back as an empty 304
+    validators = getValidators(url) if revalidate else None
+    if validators is not None:
+        if validators[2] is not None:
+            headers["If-None-Match"] = validators[2]
+        if validators[3] is not None:
+            headers["If-Modified-Since"] = validators[3]
 
-        cookies = priv.getDefaultCookies()
     r = None
     try:
-        r = requests.get(url, headers=headers, cookies=cookies, timeout=timeout)
+        # waits until the domain's politeness interval has passed instead of
+        # sleeping for delay after the request, see fetch.py
+        r = fetch.get(url, headers, cookies, timeout=timeout, delay=delay)
     except:
         util.logMessage(f"scrape|exception|{url}", "scrape.log")
         raise
+    ts = int(time.time())
+    etag = r.headers.get("ETag", None)
+    lastModified = r.headers.get("Last-Modified", None)
+
+    if r.status_code == 304 and validators is not None:
+        # unchanged: record a successful fetch pointing at the previous body
+        wid, responseHash, prevEtag, prevLastModified = validators
+        etag = prevEtag if etag is None else etag
+        lastModified = prevLastModified if lastModified is None else lastModified
+        saveWebRequest(
+            ts,
+            url,
+            200,
+            None,
+            responseHash=responseHash,
+            etag=etag,
+            lastModified=lastModified,
+        )
+        if negative is not None:
+            clearNegative(url)
+        prev = loadScrapeBody({"id": wid})
+        return {"url": url, "fetched": ts, "raw": prev["raw"], "unchanged": True}
 
     if r.status_code != 200:
         saveWebRequest(ts, url, r.status_code, None)
-        delaySecs(delay)
+        recordNegative(
+            url, r.status_code, parseRetryAfter(r.headers.get("Retry-After", None))
+        )
         raise Exception(f"failed to download url {r.status_code}: {url}")
 
     raw = r.content
     text = decodeRequest(raw, url)
 
-    saveWebRequest(ts, url, r.status_code, text)
-    delaySecs(delay)
+    saveWebRequest(ts, url, r.status_code, text, etag=etag, lastModified=lastModified)
+    if negative is not None:
+        clearNegative(url)
     return {"url": url, "fetched": ts, "raw": text}
 
 
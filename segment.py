@@ -0,0 +1,333 @@
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+import glob
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+# Segments hold archived web rows outside of postgres. A segment named {path}
+# is made of:
+#   {path}.seg: magic, then records appended one after another
+#   {path}.idx: magic, then sorted (url hash, id, offset) entries
+#   {path}.kdx: magic, then sorted (urlKey hash, id, offset) entries
+#
+# A record is a recordHeader followed by the url, source, and response. The
+# response is kept exactly as it was stored in postgres (compressed, see
+# codec.py); a bodyLength of -1 means the row had no response.
+#
+# Index entries are fixed width so an mmap of the index can be binary searched
+# in place. Urls are hashed to 8 bytes to keep them fixed width; a lookup
+# checks the url of every candidate record so collisions are harmless. Within
+# a hash entries are ordered by id, so the last match is the most recent.
+segmentMagic = b"HWSEG001"
+indexMagic = b"HWIDX001"
+recordHeader = struct.Struct(">qqhHHi")
+indexEntry = struct.Struct(">QqQ")
+
+SegmentRecord = Tuple[int, int, int, str, Optional[str], Optional[bytes]]
+
+
+def hashKey(s: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), byteorder="big"
+    )
+
+
+def urlKey(url: str) -> str:
+    import scrape
+
+    return scrape.urlKey(url)
+
+
+# yield (offset, id, url, end) for every record in a segment. If torn is set
+# a partially written record at the end (from a crashed writer) ends the
+# iteration instead of raising.
+def iterRecordHeaders(
+    path: str, torn: bool = False
+) -> Iterator[Tuple[int, int, str, int]]:
+    size = os.path.getsize(path + ".seg")
+    with open(path + ".seg", "rb") as f:
+        if f.read(len(segmentMagic)) != segmentMagic:
+            raise Exception(f"segment: bad magic in {path}.seg")
+        offset = len(segmentMagic)
+        while offset < size:
+            header = f.read(recordHeader.size)
+            end = offset + recordHeader.size
+            if len(header) == recordHeader.size:
+                wid, _, _, urlLen, sourceLen, bodyLen = recordHeader.unpack(header)
+                end += urlLen + sourceLen + max(0, bodyLen)
+            if end > size:
+                if torn:
+                    break
+                raise Exception(f"segment: truncated record at {offset} in {path}")
+            url = f.read(urlLen).decode("utf-8")
+            f.seek(sourceLen + max(0, bodyLen), os.SEEK_CUR)
+            yield (offset, wid, url, end)
+            offset = end
+
+
+def writeIndex(path: str, entries: List[Tuple[int, int, int]]) -> None:
+    entries.sort()
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(indexMagic)
+        for entry in entries:
+            f.write(indexEntry.pack(*entry))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpPath, path)
+
+
+# (re)build the .idx and .kdx files from the records in {path}.seg
+def buildIndexes(path: str) -> int:
+    urls: List[Tuple[int, int, int]] = []
+    keys: List[Tuple[int, int, int]] = []
+    for offset, wid, url, _ in iterRecordHeaders(path):
+        urls.append((hashKey(url), wid, offset))
+        keys.append((hashKey(urlKey(url)), wid, offset))
+    writeIndex(path + ".idx", urls)
+    writeIndex(path + ".kdx", keys)
+    return len(urls)
+
+
+# append records to a segment; indexes are rebuilt on close. Opening an
+# existing segment drops any torn record left by a crash, and maxId tells the
+# caller where to resume.
+class SegmentWriter:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.count = 0
+        self.maxId = -1
+        if os.path.isfile(path + ".seg") and os.path.getsize(path + ".seg") > 0:
+            end = len(segmentMagic)
+            for _, wid, _, recordEnd in iterRecordHeaders(path, torn=True):
+                self.maxId = max(self.maxId, wid)
+                end = recordEnd
+            os.truncate(path + ".seg", end)
+        self.f: IO[bytes] = open(path + ".seg", "ab")  # noqa: SIM115
+        if self.f.tell() == 0:
+            self.f.write(segmentMagic)
+
+    def append(
+        self,
+        wid: int,
+        created: int,
+        url: str,
+        status: int,
+        source: Optional[str],
+        response: Optional[bytes],
+    ) -> None:
+        burl = url.encode("utf-8")
+        bsource = b"" if source is None else source.encode("utf-8")
+        bodyLen = -1 if response is None else len(response)
+        self.f.write(
+            recordHeader.pack(wid, created, status, len(burl), len(bsource), bodyLen)
+        )
+        self.f.write(burl)
+        self.f.write(bsource)
+        if response is not None:
+            self.f.write(response)
+        self.count += 1
+
+    def flush(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self) -> None:
+        self.flush()
+        self.f.close()
+        buildIndexes(self.path)
+
+
+class Segment:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.data = self._map(".seg", segmentMagic)
+        self.urls = self._map(".idx", indexMagic)
+        self.keys = self._map(".kdx", indexMagic)
+
+    def _map(self, ext: str, magic: bytes) -> mmap.mmap:
+        with open(self.path + ext, "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if m[: len(magic)] != magic:
+            raise Exception(f"segment: bad magic in {self.path}{ext}")
+        return m
+
+    def close(self) -> None:
+        self.data.close()
+        self.urls.close()
+        self.keys.close()
+
+    @staticmethod
+    def _entry(index: mmap.mmap, i: int) -> Tuple[int, int, int]:
+        res: Tuple[int, int, int] = indexEntry.unpack_from(
+            index, len(indexMagic) + i * indexEntry.size
+        )
+        return res
+
+    @staticmethod
+    def _count(index: mmap.mmap) -> int:
+        return (len(index) - len(indexMagic)) // indexEntry.size
+
+    # yield (id, offset) for entries with hash h, most recent first
+    def _candidates(self, index: mmap.mmap, h: int) -> Iterator[Tuple[int, int]]:
+        lo, hi = 0, self._count(index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(index, mid)[0] <= h:
+                lo = mid + 1
+            else:
+                hi = mid
+        i = lo - 1
+        while i >= 0:
+            eh, wid, offset = self._entry(index, i)
+            if eh != h:
+                break
+            yield (wid, offset)
+            i -= 1
+
+    def maxId(self) -> int:
+        res = -1
+        for i in range(self._count(self.urls)):
+            res = max(res, self._entry(self.urls, i)[1])
+        return res
+
+    # read (id, created, status, url, source offset) at offset
+    def readHeader(self, offset: int) -> Tuple[int, int, int, str, int]:
+        wid, created, status, urlLen, _, _ = recordHeader.unpack_from(self.data, offset)
+        start = offset + recordHeader.size
+        url = self.data[start : start + urlLen].decode("utf-8")
+        return (wid, created, status, url, start + urlLen)
+
+    def read(self, offset: int) -> SegmentRecord:
+        wid, created, status, urlLen, sourceLen, bodyLen = recordHeader.unpack_from(
+            self.data, offset
+        )
+        start = offset + recordHeader.size
+        url = self.data[start : start + urlLen].decode("utf-8")
+        start += urlLen
+        source = None
+        if sourceLen > 0:
+            source = self.data[start : start + sourceLen].decode("utf-8")
+        start += sourceLen
+        response = None if bodyLen < 0 else self.data[start : start + bodyLen]
+        return (wid, created, status, url, source, response)
+
+    # find the most recent (id, offset, created, status, url) matching
+    def find(
+        self,
+        url: Optional[str] = None,
+        ukey: Optional[str] = None,
+        status: Optional[int] = 200,
+        beforeId: Optional[int] = None,
+    ) -> Optional[Tuple[int, int, int, int, str]]:
+        if ukey is not None:
+            index, want = self.keys, ukey
+        elif url is not None:
+            index, want = self.urls, url
+        else:
+            raise Exception("segment.find: url or ukey is required")
+        for wid, offset in self._candidates(index, hashKey(want)):
+            if beforeId is not None and wid > beforeId:
+                continue
+            _, created, rstatus, rurl, _ = self.readHeader(offset)
+            if status is not None and rstatus != status:
+                continue
+            if (urlKey(rurl) if ukey is not None else rurl) != want:
+                continue
+            return (wid, offset, created, rstatus, rurl)
+        return None
+
+
+# all of the segments in a directory, searched together
+class SegmentArchive:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.segments: Dict[str, Segment] = {}
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self) -> None:
+        with self.lock:
+            for seg in self.segments.values():
+                seg.close()
+            self.segments = {}
+            for spath in sorted(glob.glob(os.path.join(self.directory, "*.seg"))):
+                path = spath[: -len(".seg")]
+                if not os.path.isfile(path + ".idx"):
+                    continue  # still being written
+                self.segments[path] = Segment(path)
+
+    def find(
+        self,
+        url: Optional[str] = None,
+        ukey: Optional[str] = None,
+        status: Optional[int] = 200,
+        beforeId: Optional[int] = None,
+    ) -> Optional[Tuple[Segment, Tuple[int, int, int, int, str]]]:
+        best: Optional[Tuple[Segment, Tuple[int, int, int, int, str]]] = None
+        for seg in list(self.segments.values()):
+            r = seg.find(url, ukey, status, beforeId)
+            if r is not None and (best is None or r[0] > best[1][0]):
+                best = (seg, r)
+        return best
+
+    def read(self, path: str, offset: int) -> SegmentRecord:
+        return self.segments[path].read(offset)
+
+
+_archive: Optional[SegmentArchive] = None
+_archiveLock = threading.Lock()
+_archiveMtime = 0.0
+
+
+def getArchiveDirectory() -> Optional[str]:
+    return os.environ.get("HERMES_SEGMENTS", None)
+
+
+# with HERMES_SEGMENTS_ONLY set web archive reads are served only from the
+# segments in HERMES_SEGMENTS and minerva's web tables are never touched
+def segmentsOnly() -> bool:
+    return "HERMES_SEGMENTS_ONLY" in os.environ
+
+
+# compression dictionaries are copied next to the segments so they can be
+# decompressed without web_dict; files are named {id}.{codec}.{domain}.dict
+def writeDictionaries(
+    directory: str, dictionaries: List[Tuple[int, str, int, bytes]]
+) -> None:
+    os.makedirs(directory, exist_ok=True)
+    for did, domain, codec, data in dictionaries:
+        path = os.path.join(directory, f"{did}.{codec}.{domain}.dict")
+        if os.path.isfile(path):
+            continue
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+
+def readDictionaries(directory: str) -> List[Tuple[int, str, int, bytes]]:
+    res: List[Tuple[int, str, int, bytes]] = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.dict"))):
+        did, codec, domain = os.path.basename(path)[: -len(".dict")].split(".", 2)
+        with open(path, "rb") as f:
+            res.append((int(did), domain, int(codec), f.read()))
+    return res
+
+
+# the archive in $HERMES_SEGMENTS, or None if it isn't set. Segments added to
+# the directory since the last call are picked up.
+def getArchive() -> Optional[SegmentArchive]:
+    global _archive, _archiveMtime
+    directory = getArchiveDirectory()
+    if directory is None or not os.path.isdir(directory):
+        return None
+    mtime = os.stat(directory).st_mtime
+    with _archiveLock:
+        if _archive is None:
+            _archive = SegmentArchive(directory)
+        elif mtime != _archiveMtime:
+            _archive.refresh()
+        _archiveMtime = mtime
+    return _archive
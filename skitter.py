@@ -1,12 +1,104 @@
-import contextlib
+from typing import Callable, Dict, List, Optional, Sequence, TypeVar
+import concurrent.futures
+import os
 
 import priv
 import scrape as sc
+from skitter_client import SkitterClient, originStatus
 import util
 from weaver_client import WeaverClient
 
+T = TypeVar("T")
 
-def scrape(url: str, staleOnly: bool = False, fallback: bool = False) -> sc.ScrapeMeta:
+# Requests go to the clients in priority order. For read only lookups (cache),
+# rather than waiting out a slow client's whole timeout before moving on, the
+# next client is also asked once the current one has taken longer than
+# hedgePercentile of its recent requests, and the first good answer wins.
+# Anything that may crawl the origin site or save what it got is never hedged,
+# so a slow crawl doesn't hit the site twice and save two rows. A client that
+# fails hands over to the next immediately. With HERMES_SKITTER_SERIAL set
+# clients are only tried one after another, as before.
+hedgePercentile = 95
+# seconds to wait before hedging a client with no latency history yet, and the
+# least we'll wait for any client
+hedgeDefault = 5.0
+hedgeMinimum = 0.5
+
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=8, thread_name_prefix="skitter"
+)
+
+
+def hedgeDelay(c: SkitterClient) -> Optional[float]:
+    if "HERMES_SKITTER_SERIAL" in os.environ:
+        return None
+    p = c.latencyPercentile(hedgePercentile)
+    return hedgeDefault if p is None else max(hedgeMinimum, p)
+
+
+# run call against clients in order and return the first result that isn't
+# None. Slow clients are hedged if hedge is set; only do that for calls that
+# don't write anything. Failures are logged if label is given and collected
+# in failures if that is given.
+def firstResult(
+    clients: Sequence[SkitterClient],
+    call: Callable[[SkitterClient], Optional[T]],
+    label: Optional[str] = None,
+    hedge: bool = True,
+    failures: Optional[List[Exception]] = None,
+) -> Optional[T]:
+    queue = list(clients)
+    pending: Dict["concurrent.futures.Future[Optional[T]]", SkitterClient] = {}
+
+    def launch() -> Optional[float]:
+        c = queue.pop(0)
+        pending[_executor.submit(call, c)] = c
+        return hedgeDelay(c) if hedge else None
+
+    if len(queue) == 0:
+        return None
+    delay = launch()
+    while len(pending) > 0:
+        done, _ = concurrent.futures.wait(
+            pending,
+            timeout=delay if len(queue) > 0 else None,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        if len(done) == 0:
+            # the newest request is slow, hedge it with the next client
+            delay = launch()
+            continue
+        for f in done:
+            c = pending.pop(f)
+            try:
+                r = f.result()
+            except Exception as e:
+                if label is not None:
+                    util.logMessage(f"skitter.{label}: {c.ident}.{label} failed: {e}")
+                if failures is not None:
+                    failures.append(e)
+                r = None
+            if r is not None:
+                return r
+        if len(queue) > 0:
+            delay = launch()
+    return None
+
+
+# back url off like a failed direct fetch, but only if a client reached the
+# origin site and it refused the page. Failures of skitter itself (outages,
+# proxy errors, bad credentials) say nothing about the url.
+def recordFailure(url: str, failures: List[Exception]) -> None:
+    for e in reversed(failures):
+        status = originStatus(e)
+        if status is not None:
+            sc.recordNegative(sc.canonizeUrl(url), status)
+            return
+
+
+def scrape(
+    url: str, staleOnly: bool = False, fallback: bool = False, force: bool = False
+) -> sc.ScrapeMeta:
     if sc._staleOnly:
         util.logMessage(f"skitter.scrape: HERMES_STALE only {url}")
         return sc.scrape(url)
@@ -19,44 +111,85 @@ def scrape(url: str, staleOnly: bool = False, fallback: bool = False) -> sc.Scra
                 return ce
         raise Exception(f"skitter.scrape: unable to staleOnly scrape: {url}")
 
-    for c in priv.skitterClients:
-        try:
-            # util.logMessage(f'skitter.scrape: calling {c.ident}.scrape({url})')
-            r = c.scrape(url)
-            return r
-        except Exception as e:
-            util.logMessage(f"skitter.scrape: {c.ident}.scrape failed: {e}")
-            pass
+    # don't refetch urls that recently failed until their backoff passes
+    negative = sc.checkNegative(sc.canonizeUrl(url), force)
+
+    failures: List[Exception] = []
+    r = firstResult(
+        priv.skitterClients, lambda c: c.scrape(url), "scrape", False, failures
+    )
+    if r is not None:
+        if negative is not None:
+            sc.clearNegative(sc.canonizeUrl(url))
+        return r
 
     if fallback:
-        return sc.scrape(url)
+        return sc.scrape(url, force=force)
+    recordFailure(url, failures)
     raise Exception(f"skitter.scrape: unable to scrape: {url}")
 
 
 def softScrape(url: str, fallback: bool = False) -> sc.ScrapeMeta:
-    # return old copy if any exists
-    for c in reversed(priv.skitterClients):
-        if isinstance(c, WeaverClient):
-            continue
-        with contextlib.suppress(Exception):
-            # util.logMessage(f'skitter.softScrape: {c.ident}.staleScrape({url})')
-            r = c.staleScrape(url)
-            if r is not None:
-                return r
+    if sc._staleOnly:
+        util.logMessage(f"skitter.softScrape: HERMES_STALE only {url}")
+        return sc.scrape(url)
+
+    # return old copy if any exists, either saved here or in a client's cache.
+    # Only the winning cache hit is saved, hedged lookups may both find it.
+    r = sc.getMostRecentScrapeWithMeta(sc.canonizeUrl(url))
+    if r is not None:
+        return r
+    stale = [
+        c for c in reversed(priv.skitterClients) if not isinstance(c, WeaverClient)
+    ]
+    r = firstResult(stale, lambda c: c.cache(sc.canonizeUrl(url)))
+    if r is not None:
+        sc.saveWebRequest(r["fetched"], r["url"], r["status"], r["raw"])
+        return r
 
-    # attempt to softScrape
-    for c in priv.skitterClients:
-        with contextlib.suppress(Exception):
-            # util.logMessage(f'FFNAdapter.softScrape: {c.ident}.softScrape({url})')
-            return c.softScrape(url)
+    # attempt to softScrape; this may crawl, so respect any recent failure's
+    # backoff first
+    negative = sc.checkNegative(sc.canonizeUrl(url))
+    failures: List[Exception] = []
+    r = firstResult(
+        priv.skitterClients, lambda c: c.softScrape(url), None, False, failures
+    )
+    if r is not None:
+        if negative is not None:
+            sc.clearNegative(sc.canonizeUrl(url))
+        return r
 
     if fallback:
         r = sc.softScrapeWithMeta(url)
         if r is not None:
             return r
+    else:
+        recordFailure(url, failures)
     raise Exception(f"skitter.softScrape: unable to softScrape: {url}")
 
 
+# look many urls up in the clients' caches at once. Urls are spread over the
+# clients round robin and looked up concurrently; a url one client doesn't
+# have (or fails on) is tried on the others in turn.
+def cache(urls: Sequence[str], rev: bool = False) -> Dict[str, Optional[sc.ScrapeMeta]]:
+    clients: List[SkitterClient] = list(priv.skitterClients)
+
+    def lookup(i: int, url: str) -> Optional[sc.ScrapeMeta]:
+        for j in range(len(clients)):
+            c = clients[(i + j) % len(clients)]
+            try:
+                r = c.cache(url, rev=rev)
+            except Exception as e:
+                util.logMessage(f"skitter.cache: {c.ident}.cache failed: {e}")
+                continue
+            if r is not None:
+                return r
+        return None
+
+    futures = [_executor.submit(lookup, i, url) for i, url in enumerate(urls)]
+    return {url: f.result() for url, f in zip(urls, futures)}
+
+
 if __name__ == "__main__":
     import sys
 
@@ -67,26 +200,32 @@ if __name__ == "__main__":
     skitter_secondary: SkitterClient = priv.skitterClients[-1]
 
     if sys.argv[1] == "recache":
-        for line in sys.stdin.readlines():
-            line = line.strip()
-            url = canonizeUrl(line)
-            print(url)
-            # we want the newest version of non-1 chapters, otherwise the oldest
-            # (so we skip now-deleted info requests for chap 1)
-            res = skitter_secondary.cache(url, rev=url.endswith("/1"))
-            if res is not None:
-                saveWebRequest(res["fetched"], res["url"], res["status"], res["raw"])
-            else:
-                print("  FAILED")
+        with sc.batchWebWrites():
+            for line in sys.stdin.readlines():
+                line = line.strip()
+                url = canonizeUrl(line)
+                print(url)
+                # we want the newest version of non-1 chapters, otherwise the
+                # oldest (so we skip now-deleted info requests for chap 1)
+                res = skitter_secondary.cache(url, rev=url.endswith("/1"))
+                if res is not None:
+                    saveWebRequest(
+                        res["fetched"], res["url"], res["status"], res["raw"]
+                    )
+                else:
+                    print("  FAILED")
     elif sys.argv[1] == "rescrape":
         print("rescrape")
-        for line in sys.stdin.readlines():
-            line = line.strip()
-            url = canonizeUrl(line)
-            print(url)
-            try:
-                res = skitter_primary.crawl(url)
-                saveWebRequest(res["fetched"], res["url"], res["status"], res["raw"])
-            except:
-                print("  FAILED")
-                raise
+        with sc.batchWebWrites():
+            for line in sys.stdin.readlines():
+                line = line.strip()
+                url = canonizeUrl(line)
+                print(url)
+                try:
+                    res = skitter_primary.crawl(url)
+                    saveWebRequest(
+                        res["fetched"], res["url"], res["status"], res["raw"]
+                    )
+                except:
+                    print("  FAILED")
+                    raise
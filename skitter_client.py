@@ -1,19 +1,37 @@
 #!/usr/bin/env python3
-from typing import Dict, Optional
+from typing import Collection, Deque, Dict, Optional
+from collections import deque
+import re
 import time
 import urllib.parse
 
+import fetch
+import responseCache
 from scrape import (
     ScrapeMeta,
     canonizeUrl,
     decodeRequest,
     delaySecs,
-    getLastUrlLike,
     getMostRecentScrapeWithMeta,
     saveWebRequest,
 )
 import util
 
+# how many recent request latencies each client keeps, and how many it needs
+# before its percentiles are trusted
+latencySamples = 256
+minLatencySamples = 8
+
+# crawl statuses that are the origin site's own answer rather than skitter's
+originStatuses = {404, 410}
+
+
+# the origin site's status if e is a crawl the origin itself refused, None for
+# failures of skitter (errors, bad credentials, outages) or the connection
+def originStatus(e: Exception) -> Optional[int]:
+    m = re.match(r"SkitterClient: origin returned (\d+):", str(e))
+    return None if m is None else int(m.group(1))
+
 
 def buildScrapeMeta(
     url: str, fetched: int, raw: Optional[str], status: int = 200
@@ -44,12 +62,22 @@ class SkitterClient:
         self.auth = (uname, upass)
 
         self.ident = uname if ident is None else ident
+        self.latencies: Deque[float] = deque(maxlen=latencySamples)
+
+    # the p-th percentile of recent successful request latencies in seconds,
+    # or None if there aren't enough samples yet
+    def latencyPercentile(self, p: float) -> Optional[float]:
+        samples = sorted(self.latencies)
+        if len(samples) < minLatencySamples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
 
     def _makeRequest(
-        self, apiUrl: str, params: Optional[Dict[str, str]]
+        self,
+        apiUrl: str,
+        params: Optional[Dict[str, str]],
+        originFailures: Collection[int] = (),
     ) -> Optional[ScrapeMeta]:
-        import requests
-
         r = None
         ts0 = time.time()
         # while we have time to retry
@@ -58,7 +86,7 @@ class SkitterClient:
                 # attempt a request
                 timePassed = time.time() - ts0
                 timeLeft = self.timeout - timePassed
-                r = requests.get(
+                r = fetch.getSession(apiUrl).get(
                     apiUrl,
                     headers=self.headers,
                     params=params,
@@ -89,6 +117,12 @@ class SkitterClient:
                 f"SkitterClient._makeRequest: failed to make request: {apiUrl}"
             )
 
+        if r.status_code in {200, 404}:
+            self.latencies.append(time.time() - ts0)
+
+        if r.status_code in originFailures:
+            raise Exception(f"SkitterClient: origin returned {r.status_code}: {params}")
+
         if r.status_code == 404:
             return None
 
@@ -120,15 +154,28 @@ class SkitterClient:
         assert p[1] is not None
         # p = (p[0], urllib.parse.quote(p[1], safe=''))
 
+        # lookups share the response cache with scrape.py and are dropped when
+        # we save a newer copy of the url. Misses aren't kept, a later crawl
+        # may well fetch the page.
+        url = canonizeUrl(p[1])
+        key = ("skitter", url, p[0], self.baseUrl, rev)
+        cached = responseCache.getCache().get(key)
+        if cached is not None:
+            return cached
+        generation = responseCache.getCache().generation
+
         apiUrl = urllib.parse.urljoin(self.baseUrl, "v0/cache")
         apiArgs = {p[0]: p[1]}
         if rev:
             apiArgs["r"] = "1"
-        return self._makeRequest(apiUrl, apiArgs)
+        res = self._makeRequest(apiUrl, apiArgs)
+        if res is not None:
+            responseCache.getCache().put(key, res, url, generation=generation)
+        return res
 
     def crawl(self, q: str) -> ScrapeMeta:
         apiUrl = urllib.parse.urljoin(self.baseUrl, "v0/crawl")
-        res = self._makeRequest(apiUrl, {"q": q})
+        res = self._makeRequest(apiUrl, {"q": q}, originStatuses)
         if res is None:
             raise Exception(f"SkitterClient.crawl: failed to crawl: {q}")
         return res
@@ -136,10 +183,8 @@ class SkitterClient:
     def staleScrape(self, url: str) -> Optional[ScrapeMeta]:
         url = canonizeUrl(url)
         # check if we already have it in our db, return it if we do
-        tmpUrl = getLastUrlLike(url)
-        if tmpUrl is not None:
-            res = getMostRecentScrapeWithMeta(url)
-            assert res is not None
+        res = getMostRecentScrapeWithMeta(url)
+        if res is not None:
             return res
 
         # check if it's in .cache
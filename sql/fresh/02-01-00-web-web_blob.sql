@@ -0,0 +1 @@
+../.././sql/web/web_blob.sql
\ No newline at end of file
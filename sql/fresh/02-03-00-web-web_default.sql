@@ -0,0 +1 @@
+../.././sql/web/web_default.sql
\ No newline at end of file
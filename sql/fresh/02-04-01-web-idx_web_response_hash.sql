@@ -0,0 +1 @@
+../.././sql/web/idx_web_response_hash.sql
\ No newline at end of file
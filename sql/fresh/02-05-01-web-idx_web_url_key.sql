@@ -0,0 +1 @@
+../.././sql/web/idx_web_url_key.sql
\ No newline at end of file
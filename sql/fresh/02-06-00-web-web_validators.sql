@@ -0,0 +1 @@
+../.././sql/web/web_validators.sql
\ No newline at end of file
@@ -0,0 +1 @@
+../.././sql/web/web_dict.sql
\ No newline at end of file
@@ -0,0 +1 @@
+../.././sql/web/web_negative.sql
\ No newline at end of file
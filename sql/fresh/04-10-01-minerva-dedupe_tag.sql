@@ -0,0 +1 @@
+../.././sql/minerva/dedupe_tag.sql
\ No newline at end of file
@@ -0,0 +1 @@
+../.././sql/minerva/idx_tag_unique.sql
\ No newline at end of file
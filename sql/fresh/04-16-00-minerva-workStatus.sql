@@ -0,0 +1 @@
+../.././sql/minerva/workStatus.sql
\ No newline at end of file
@@ -0,0 +1 @@
+../.././sql/minerva/work_queue.sql
\ No newline at end of file
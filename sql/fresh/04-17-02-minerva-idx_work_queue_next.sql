@@ -0,0 +1 @@
+../.././sql/minerva/idx_work_queue_next.sql
\ No newline at end of file
@@ -0,0 +1,41 @@
+-- merge duplicate tags (same type, name, parent and source) into the one with
+-- the lowest id so idx_tag_unique can be created; older versions could define
+-- the same tag twice. Merging two parents can make their children duplicates
+-- in turn, so repeat until none are left.
+do $$
+declare
+	merged boolean := false;
+begin
+	loop
+		create temp table tag_dup as
+		select id, keepId from (
+			select id, min(id) over (
+				partition by type, name, coalesce(parent, -1), coalesce(sourceId, -1)
+			) as keepId
+			from tag
+		) t
+		where id <> keepId;
+
+		if not exists (select 1 from tag_dup) then
+			drop table tag_dup;
+			exit;
+		end if;
+		merged := true;
+
+		if to_regclass('fic_tag') is not null then
+			update fic_tag ft set tagId = d.keepId
+			from tag_dup d where ft.tagId = d.id;
+		end if;
+		update tag t set parent = d.keepId
+		from tag_dup d where t.parent = d.id;
+		delete from tag t using tag_dup d where t.id = d.id;
+		drop table tag_dup;
+	end loop;
+
+	-- a fic tagged with two of the merged tags now has the same link twice
+	if merged and to_regclass('fic_tag') is not null then
+		delete from fic_tag a using fic_tag b
+		where a.ficId = b.ficId and a.tagId = b.tagId
+			and (a.priority, a.ctid) > (b.priority, b.ctid);
+	end if;
+end $$
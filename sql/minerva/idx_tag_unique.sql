@@ -0,0 +1,6 @@
+-- one row per tag; a null parent or source counts as a value of its own,
+-- see store.DimensionRegistry
+create unique index if not exists idx_tag_unique on tag (
+	type, name, coalesce(parent, -1), coalesce(sourceId, -1)
+);
+
@@ -0,0 +1,3 @@
+create index if not exists idx_work_queue_next on work_queue ( priority desc, id asc )
+	where status in ('pending', 'leased');
+
@@ -0,0 +1,3 @@
+create unique index if not exists idx_work_queue_open on work_queue ( kind, payload )
+	where status in ('pending', 'leased');
+
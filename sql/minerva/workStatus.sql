@@ -0,0 +1,8 @@
+do $$ begin
+
+create type workStatus as enum ('pending', 'leased', 'done', 'failed');
+
+exception
+	when duplicate_object then null;
+end $$
+
@@ -0,0 +1,15 @@
+create table if not exists work_queue (
+	id bigserial primary key,
+	kind text not null,
+	payload text not null,
+	priority int4 not null default(0),
+	status workStatus not null default('pending'),
+	tries int4 not null default(0),
+	maxTries int4 not null default(5),
+	visibleAt int8 not null default(0),
+	leasedBy varchar(128) null,
+	created oil_timestamp not null default(oil_timestamp()),
+	finished oil_timestamp null,
+	lastError text null
+);
+
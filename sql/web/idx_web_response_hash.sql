@@ -0,0 +1,2 @@
+create index if not exists idx_web_response_hash on web ( responseHash );
+
@@ -0,0 +1,2 @@
+create index if not exists idx_web_url_key on web ( urlKey text_pattern_ops, status, created );
+
@@ -1,9 +1,18 @@
+-- partitioned by month of created (unix seconds), see webArchive.py
 create table if not exists web (
-	id bigserial primary key,
+	id bigserial not null,
 	created oil_timestamp not null default(oil_timestamp()),
 	url url not null,
+	-- normalized lookup key, see scrape.urlKey
+	urlKey url null,
 	status smallint not null,
 	source varchar(64) null,
-	response bytea not null
-);
+	-- legacy inline body, new rows reference web_blob through responseHash
+	response bytea null,
+	responseHash bytea null references web_blob(hash),
+	-- validators for conditional requests, see scrape.scrape(revalidate)
+	etag varchar(1024) null,
+	lastModified varchar(64) null,
+	primary key (id, created)
+) partition by range (created);
 
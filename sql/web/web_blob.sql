@@ -0,0 +1,6 @@
+create table if not exists web_blob (
+	hash bytea primary key,
+	created oil_timestamp not null default(oil_timestamp()),
+	response bytea not null
+);
+
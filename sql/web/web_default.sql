@@ -0,0 +1,3 @@
+-- catches rows outside of any monthly partition, see webArchive.py partitions
+create table if not exists web_default partition of web default;
+
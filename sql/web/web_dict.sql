@@ -0,0 +1,8 @@
+create table if not exists web_dict (
+	id serial primary key,
+	created oil_timestamp not null default(oil_timestamp()),
+	domain varchar(256) not null,
+	codec smallint not null,
+	dict bytea not null
+);
+
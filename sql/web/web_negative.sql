@@ -0,0 +1,8 @@
+create table if not exists web_negative (
+	url url primary key,
+	status smallint not null,
+	failures integer not null default(1),
+	lastFailure bigint not null,
+	retryAfter bigint not null
+);
+
@@ -0,0 +1,4 @@
+-- upgrade pre-web_blob archives in place
+alter table web add column if not exists responseHash bytea null references web_blob(hash);
+alter table web alter column response drop not null;
+
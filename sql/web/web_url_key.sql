@@ -0,0 +1,3 @@
+-- upgrade pre-urlKey archives in place, backfill with webArchive.py urlKeys
+alter table web add column if not exists urlKey url null;
+
@@ -0,0 +1,4 @@
+-- upgrade archives from before conditional requests in place
+alter table web add column if not exists etag varchar(1024) null;
+alter table web add column if not exists lastModified varchar(64) null;
+
@@ -1,9 +1,12 @@
-from typing import Any, Dict, List, Optional, Set, Tuple, Type, TypeVar
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Type, TypeVar
+import threading
+import time
 
 from htypes import FicId, FicType, getAdapter
+import lite
 from lite import StoreType
 import store_bases
-from store_bases import FicStatus, ImportStatus, OilTimestamp, TagType
+from store_bases import FicStatus, ImportStatus, OilTimestamp, TagType, WorkStatus
 import util
 
 defaultUserId = 1  # FIXME
@@ -22,34 +25,13 @@ class TagBase(store_bases.Tag):
         sourceId: Optional[int] = None,
     ) -> T:
         assert cls.ttype is not None
-        whereData = {"type": cls.ttype, "name": name}
-        if parent is not None:
-            whereData["parent"] = parent
-        if sourceId is not None:
-            whereData["sourceId"] = sourceId
-        es = cls.select(whereData)
-        if parent is None:
-            es = [e for e in es if e.parent is None]
-        if sourceId is None:
-            es = [e for e in es if e.sourceId is None]
-        if len(es) == 1:
-            return es[0]
-        if len(es) > 0:
-            raise Exception(
-                f"FIXME dup cls.ttype={cls.ttype} name={name} sourceId={sourceId}"
-            )
-        e = cls.new()
-        e.type = cls.ttype
-        e.name = name
-        e.parent = parent
-        e.sourceId = sourceId
-        e.insert()
-        return cls.define(name, parent, sourceId)
+        return cls.fromRow(registry.tag(cls.ttype, name, parent, sourceId))
 
     def add(self, fic: "Fic") -> StoreType:
         e = FicTagBase.select({"ficId": fic.id, "tagId": self.id})
         if len(e) > 0:
             return e[0]
+        fic._cachedTags = None
         n = FicTagBase.new()
         n.ficId = fic.id
         n.tagId = self.id
@@ -125,6 +107,20 @@ class FicCharacter(FicTagBase):
     ttype = TagType.character
 
 
+_tagClasses: Dict[TagType, Type[TagBase]] = {
+    TagType.genre: Genre,
+    TagType.tag: Tag,
+    TagType.fandom: Fandom,
+    TagType.character: Character,
+}
+_ficTagClasses: Dict[TagType, Type[FicTagBase]] = {
+    TagType.genre: FicGenre,
+    TagType.tag: FicTag,
+    TagType.fandom: FicFandom,
+    TagType.character: FicCharacter,
+}
+
+
 class ReadEvent(store_bases.ReadEvent):
     @classmethod
     def record(
@@ -144,8 +140,6 @@ class ReadEvent(store_bases.ReadEvent):
         return re
 
 
-_authorCache: Dict[int, "Author"] = {}
-_authorSourceCache: Dict[int, Dict[int, "AuthorSource"]] = {}
 _ficTagCache: Dict[int, List[FicTag]] = {}
 
 
@@ -161,48 +155,36 @@ def initFicTagCache() -> None:
             _ficTagCache[f.id] = []
 
 
+# the order Fic.list and Fic.iterList return fics in
+ficListOrder = """
+    case when exists (
+        select 1 from user_fic uf
+        where uf.userId = 1 and uf.ficId = id
+    ) then 1 else 0 end desc,
+    case when ficStatus = 'abandoned' then -1 else 1 end desc,
+    case when ficStatus = 'complete' then 1 else -1 end desc,
+    created desc
+    """
+
+
 class Fic(store_bases.Fic):
     def __init__(self) -> None:
         super().__init__()
-        self._cachedFandoms: Optional[List[Fandom]] = None
+        # tags by type, filled per type on first use or all at once by
+        # prefetchTags
+        self._cachedTags: Optional[Dict[TagType, List[TagBase]]] = None
         self.urlId = util.randomString(8, charset=util.urlIdCharset)
         self.importStatus = ImportStatus.pending
 
-    def insert(self) -> None:
-        super().insert()
-        # FIXME parent insert should set the serials if present
-        fics = Fic.select({"urlId": self.urlId})
-        assert len(fics) == 1
-        nfic = fics[0]
-        self.id = nfic.id
-
     def fid(self) -> FicId:
         return FicId(FicType(self.sourceId), self.localId, ambiguous=False)
 
     def getAuthorName(self) -> str:
-        global _authorCache, _authorSourceCache
-
-        if len(_authorCache) == 0:
-            _authorCache = {a.id: a for a in Author.select({})}
-        # Ensure author is cached
-        if self.authorId not in _authorCache:
-            _authorCache[self.authorId] = Author.lookup((self.authorId,))
-
-        if self.sourceId not in _authorSourceCache:
-            _authorSourceCache[self.sourceId] = {}
-        if len(_authorSourceCache[self.sourceId]) == 0:
-            _authorSourceCache[self.sourceId] = {
-                s.authorId: s for s in AuthorSource.select({"sourceId": self.sourceId})
-            }
-
-        if self.authorId in _authorSourceCache[self.sourceId]:
-            return _authorSourceCache[self.sourceId][self.authorId].name
-
-        s = AuthorSource.select({"authorId": self.authorId, "sourceId": self.sourceId})
-        if len(s) == 1:
-            return s[0].name
+        s = registry.authorSource(self.authorId, self.sourceId)
+        if s is not None:
+            return s.name
         raise Exception(
-            f"unable to find self.authorId={self.authorId}, self.sourceId={self.sourceId}, len(s)={len(s)}"
+            f"unable to find self.authorId={self.authorId}, self.sourceId={self.sourceId}"
         )
 
     @staticmethod
@@ -230,18 +212,12 @@ class Fic(store_bases.Fic):
         # , rating DESC
         # , favorite DESC
         # , lastViewed DESC'''
-        return Fic.select(
-            where,
-            """
-                case when exists (
-                    select 1 from user_fic uf
-                    where uf.userId = 1 and uf.ficId = id
-                ) then 1 else 0 end desc,
-                case when ficStatus = 'abandoned' then -1 else 1 end desc,
-                case when ficStatus = 'complete' then 1 else -1 end desc,
-                created desc
-                """,
-        )
+        return Fic.select(where, ficListOrder)
+
+    # Fic.list, streamed rather than loaded all at once
+    @staticmethod
+    def iterList(where: Optional[Dict[str, Any]] = None) -> Iterator["Fic"]:
+        return Fic.iterSelect(where, ficListOrder)
 
     @staticmethod
     def listAdded() -> List["Fic"]:
@@ -266,28 +242,56 @@ class Fic(store_bases.Fic):
         chapter.fic = self
         return chapter
 
+    # load the tags of every fic in fics in two queries (links, then tags)
+    # instead of one per fic and tag
+    @staticmethod
+    def prefetchTags(fics: List["Fic"]) -> None:
+        byId = {fic.id: fic for fic in fics if fic._cachedTags is None}
+        if len(byId) == 0:
+            return
+        links: Dict[int, List[int]] = {fid: [] for fid in byId}
+        with FicTagBase.getConnection().cursor() as curs:
+            curs.execute(
+                "select ficId, tagId from fic_tag where ficId = any(%s)",
+                (list(byId.keys()),),
+            )
+            for ficId, tagId in curs:
+                links[ficId].append(tagId)
+        tagIds = list({tagId for ids in links.values() for tagId in ids})
+        tags: Dict[int, TagBase] = {}
+        typeIdx = [col.name for col in TagBase.columns].index("type")
+        if len(tagIds) > 0:
+            with TagBase.getConnection().cursor() as curs:
+                curs.execute("select * from tag where id = any(%s)", (tagIds,))
+                for r in curs:
+                    tag = _tagClasses[TagType(r[typeIdx])].fromRow(r)
+                    tags[tag.id] = tag
+        for fid, fic in byId.items():
+            fic._cachedTags = {ttype: [] for ttype in _tagClasses}
+            for tagId in links[fid]:
+                tag = tags[tagId]
+                fic._cachedTags[tag.type].append(tag)
+
+    def _tagsOfType(self, ttype: TagType) -> List[Any]:
+        if self._cachedTags is None:
+            self._cachedTags = {}
+        if ttype not in self._cachedTags:
+            ours = _ficTagClasses[ttype].forFic(self.id)
+            tcls = _tagClasses[ttype]
+            self._cachedTags[ttype] = [tcls.lookup((our.tagId,)) for our in ours]
+        return self._cachedTags[ttype]
+
     def fandoms(self) -> List["Fandom"]:
-        if self._cachedFandoms is not None:
-            return self._cachedFandoms
-        # global _ficTagCache
-        # if self.id not in _ficTagCache:
-        # _ficTagCache[self.id] = [ft for ft in FicTag.select({'ficId': self.id})]
-        ours = FicFandom.forFic(self.id)
-        # ours = FicFandom.select({'ficId': self.id})
-        self._cachedFandoms = [Fandom.lookup((our.tagId,)) for our in ours]
-        return self._cachedFandoms
+        return self._tagsOfType(TagType.fandom)
 
     def genres(self) -> List["Genre"]:
-        ours = FicGenre.forFic(self.id)
-        return [Genre.lookup((our.tagId,)) for our in ours]
+        return self._tagsOfType(TagType.genre)
 
     def characters(self) -> List["Character"]:
-        ours = FicCharacter.forFic(self.id)
-        return [Character.lookup((our.tagId,)) for our in ours]
+        return self._tagsOfType(TagType.character)
 
     def tags(self) -> List["Tag"]:
-        ours = FicTag.forFic(self.id)
-        return [Tag.lookup((our.tagId,)) for our in ours]
+        return self._tagsOfType(TagType.tag)
 
     def cache(self, upto: Optional[int] = None) -> None:
         upto = upto or self.chapterCount or -1
@@ -298,7 +302,7 @@ class Fic(store_bases.Fic):
         return simpleTag.add(self)
 
     def checkForUpdates(self) -> None:
-        self._cachedFandoms = None
+        self._cachedTags = None
         ccount = self.chapterCount
         getAdapter(FicType(self.sourceId)).getCurrentInfo(self)
         if self.chapterCount is None:
@@ -391,33 +395,38 @@ class UserFicChapter(store_bases.UserFicChapter):
         self.upsert()
 
     def markRead(self) -> None:
-        _e = ReadEvent.record(
-            self.userId, self.ficId, self.localChapterId, FicStatus.complete
-        )
+        with lite.transaction():
+            _e = ReadEvent.record(
+                self.userId, self.ficId, self.localChapterId, FicStatus.complete
+            )
 
-        if self.readStatus == FicStatus.complete:
-            return
-        self.readStatus = FicStatus.complete
+            if self.readStatus == FicStatus.complete:
+                return
+            self.readStatus = FicStatus.complete
 
-        if self.markedRead is None:
-            self.markedRead = OilTimestamp.now()
-        self.upsert()
+            if self.markedRead is None:
+                self.markedRead = OilTimestamp.now()
+            self.upsert()
 
     def markAbandoned(self) -> None:
-        _e = ReadEvent.record(
-            self.userId, self.ficId, self.localChapterId, FicStatus.abandoned
-        )
+        with lite.transaction():
+            _e = ReadEvent.record(
+                self.userId, self.ficId, self.localChapterId, FicStatus.abandoned
+            )
 
-        if self.readStatus == FicStatus.abandoned:
-            return
-        self.readStatus = FicStatus.abandoned
+            if self.readStatus == FicStatus.abandoned:
+                return
+            self.readStatus = FicStatus.abandoned
 
-        if self.markedRead is None:
-            self.markedRead = OilTimestamp.now()
-        self.upsert()
+            if self.markedRead is None:
+                self.markedRead = OilTimestamp.now()
+            self.upsert()
 
 
 class FicChapter(store_bases.FicChapter):
+    # chapters carry their content, don't pin every one a command reads
+    sessionCached = False
+
     def __init__(self) -> None:
         super().__init__()
         self.fic: Optional[Fic] = None
@@ -483,15 +492,12 @@ class FicChapter(store_bases.FicChapter):
             raise Exception(f"unable to cache {FicType(fic.sourceId).name}:{fic.id}")
 
         data = adapter.softScrape(self)
+        if data is None:
+            raise Exception("unable to scrape chapter? FIXME")
 
-        self.fetched = OilTimestamp.now()
-        self.upsert()
-
-        if data is not None:
+        with lite.transaction():
+            self.fetched = OilTimestamp.now()
             self.setHtml(data)
-        else:
-            raise Exception("unable to scrape chapter? FIXME")
-        self.upsert()
 
     def html(self) -> Optional[str]:
         if self.content is None:
@@ -502,47 +508,21 @@ class FicChapter(store_bases.FicChapter):
         if self.fic is None:
             self.fic = Fic.lookup((self.ficId,))
         html = getAdapter(FicType(self.fic.sourceId)).extractContent(self.fic, html)
-        self.content = util.compress(bytes(html, "utf-8"))
+        self.content = util.compress(bytes(html, "utf-8"), self.fic.url)
         self.upsert()
 
 
 class Language(store_bases.Language):
     @classmethod
     def getId(cls, language: str) -> int:
-        es = Language.select({"name": language})
-        if len(es) == 1:
-            return es[0].id
-        if len(es) > 0:
-            raise Exception(f"multiple {language} languages?")
-        e = Language.new()
-        e.name = language
-        e.insert()
-        return Language.getId(language)
+        return registry.language(language)
 
 
 class Author(store_bases.Author):
     @classmethod
     def getId(cls, name: str, sourceId: int) -> int:
         assert isinstance(sourceId, int)
-        es = Author.select(
-            {"name": name},
-            f"""
-            case when exists (
-                select 1 from author_source s
-                where s.authorId = authorId and s.sourceId = {sourceId}
-            ) then 1 else 0 end desc""",
-        )
-        if len(es) > 1:
-            util.logMessage(f"many authors: name={name} sourceId={sourceId}")
-        if len(es) >= 1:
-            return es[0].id
-        if len(es) > 0:
-            raise Exception("FIXME")
-        e = Author.new()
-        e.name = name
-        e.urlId = util.randomString(8, charset=util.urlIdCharset)
-        e.insert()
-        return Author.getId(name, sourceId)
+        return registry.author(name, sourceId)
 
 
 class AuthorSource(store_bases.AuthorSource):
@@ -550,47 +530,340 @@ class AuthorSource(store_bases.AuthorSource):
     def getId(
         cls, authorId: int, sourceId: int, name: str, url: str, localId: str
     ) -> int:
-        es = AuthorSource.select({"authorId": authorId, "sourceId": sourceId})
-        if len(es) > 1:
-            util.logMessage(
-                f"many author source: authorId={authorId} sourceId={sourceId}"
+        return registry.defineAuthorSource(authorId, sourceId, name, url, localId)
+
+
+TagKey = Tuple[TagType, str, Optional[int], Optional[int]]
+
+
+# Tags, languages, authors and author sources are small tables that parsing
+# looks up over and over. The registry reads each in full the first time it
+# is needed and answers from memory after that. Missing tags and languages
+# are created with one insert ... on conflict ... returning, which also picks
+# up rows another process added since we loaded. author and author_source
+# have no natural unique key, so a miss is checked against the database
+# before inserting. Everything is forgotten when lite rolls a transaction back,
+# as rows created inside it are gone again.
+class DimensionRegistry:
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.tags: Optional[Dict[TagKey, Tuple[Any, ...]]] = None
+        self.languages: Optional[Dict[str, int]] = None
+        # author ids by name, lowest first
+        self.authors: Optional[Dict[str, List[int]]] = None
+        self.authorSources: Optional[Dict[Tuple[int, int], AuthorSource]] = None
+
+    def reset(self) -> None:
+        with self.lock:
+            self.tags = None
+            self.languages = None
+            self.authors = None
+            self.authorSources = None
+
+    @staticmethod
+    def tagKey(row: Tuple[Any, ...]) -> TagKey:
+        t = TagBase.fromRow(row)
+        return (t.type, t.name, t.parent, t.sourceId)
+
+    def _loadTags(self) -> Dict[TagKey, Tuple[Any, ...]]:
+        if self.tags is None:
+            with TagBase.getConnection().cursor() as curs:
+                curs.execute("select * from tag")
+                self.tags = {self.tagKey(r): tuple(r) for r in curs}
+        return self.tags
+
+    # the tag row for key, creating it if needed
+    def tag(
+        self,
+        ttype: TagType,
+        name: str,
+        parent: Optional[int],
+        sourceId: Optional[int],
+    ) -> Tuple[Any, ...]:
+        key = (ttype, name, parent, sourceId)
+        with lite.connectionLock(TagBase.getConnection()), self.lock:
+            tags = self._loadTags()
+            if key in tags:
+                return tags[key]
+            conn = TagBase.getConnection()
+            with conn.cursor() as curs:
+                curs.execute(
+                    """
+                insert into tag(type, name, parent, sourceId)
+                values(%s, %s, %s, %s)
+                on conflict (type, name, coalesce(parent, -1), coalesce(sourceId, -1))
+                do update set name = excluded.name
+                returning *
+                """,
+                    key,
+                )
+                row = curs.fetchone()
+            lite.commitWrite(conn)
+            assert row is not None
+            tags[key] = tuple(row)
+            return tags[key]
+
+    def language(self, name: str) -> int:
+        with lite.connectionLock(Language.getConnection()), self.lock:
+            if self.languages is None:
+                self.languages = {e.name: e.id for e in Language.select()}
+            if name in self.languages:
+                return self.languages[name]
+            conn = Language.getConnection()
+            with conn.cursor() as curs:
+                curs.execute(
+                    """
+                insert into language(name) values(%s)
+                on conflict (name) do update set name = excluded.name
+                returning id
+                """,
+                    (name,),
+                )
+                row = curs.fetchone()
+            lite.commitWrite(conn)
+            assert row is not None
+            self.languages[name] = int(row[0])
+            return self.languages[name]
+
+    def _loadAuthors(self) -> Dict[str, List[int]]:
+        if self.authors is None:
+            self.authors = {}
+            for e in Author.select({}, "id asc"):
+                self.authors.setdefault(e.name, []).append(e.id)
+        return self.authors
+
+    def _loadAuthorSources(self) -> Dict[Tuple[int, int], AuthorSource]:
+        if self.authorSources is None:
+            self.authorSources = {}
+            for e in AuthorSource.select({}, "id desc"):
+                self.authorSources[(e.authorId, e.sourceId)] = e
+        return self.authorSources
+
+    # the id of the author called name, preferring one already known on
+    # sourceId, creating it if needed
+    def author(self, name: str, sourceId: int) -> int:
+        with lite.connectionLock(Author.getConnection()), self.lock:
+            authors = self._loadAuthors()
+            if name not in authors:
+                ids = [e.id for e in Author.select({"name": name}, "id asc")]
+                if len(ids) > 0:
+                    authors[name] = ids
+            if name in authors:
+                ids = authors[name]
+                if len(ids) > 1:
+                    util.logMessage(f"many authors: name={name} sourceId={sourceId}")
+                sources = self._loadAuthorSources()
+                for aid in ids:
+                    if (aid, sourceId) in sources:
+                        return aid
+                return ids[0]
+
+            conn = Author.getConnection()
+            with conn.cursor() as curs:
+                curs.execute(
+                    "insert into author(name, urlId) values(%s, %s) returning id",
+                    (name, util.randomString(8, charset=util.urlIdCharset)),
+                )
+                row = curs.fetchone()
+            lite.commitWrite(conn)
+            assert row is not None
+            authors[name] = [int(row[0])]
+            return authors[name][0]
+
+    def authorSource(self, authorId: int, sourceId: int) -> Optional[AuthorSource]:
+        with self.lock:
+            sources = self._loadAuthorSources()
+            key = (authorId, sourceId)
+            if key not in sources:
+                es = AuthorSource.select({"authorId": authorId, "sourceId": sourceId})
+                if len(es) == 0:
+                    return None
+                sources[key] = es[0]
+            return sources[key]
+
+    # the id of the author_source for (authorId, sourceId), creating it or
+    # bringing its name, url and localId up to date
+    def defineAuthorSource(
+        self, authorId: int, sourceId: int, name: str, url: str, localId: str
+    ) -> int:
+        with lite.connectionLock(AuthorSource.getConnection()), self.lock:
+            e = self.authorSource(authorId, sourceId)
+            if e is not None:
+                if (e.name, e.url, e.localId) != (name, url, localId):
+                    e.name = name
+                    e.url = url
+                    e.localId = localId
+                    e.update()
+                return int(e.id)
+
+            conn = AuthorSource.getConnection()
+            with conn.cursor() as curs:
+                curs.execute(
+                    """
+                insert into author_source(authorId, sourceId, name, url, localId)
+                values(%s, %s, %s, %s, %s)
+                returning *
+                """,
+                    (authorId, sourceId, name, url, localId),
+                )
+                row = curs.fetchone()
+            lite.commitWrite(conn)
+            assert row is not None
+            e = AuthorSource.fromRow(row)
+            self._loadAuthorSources()[(authorId, sourceId)] = e
+            return int(e.id)
+
+
+registry = DimensionRegistry()
+lite.onRollback(registry.reset)
+
+
+# Work that outlives a single run (caching, updates, scrapes) is queued in
+# work_queue. Workers lease jobs with FOR UPDATE SKIP LOCKED so several can
+# drain the queue at once without taking the same job. A leased job is hidden
+# until visibleAt; if its worker dies it reappears once the lease runs out and
+# is tried again, up to maxTries. A job whose last try's lease runs out is
+# marked failed rather than leased again, so one that kills its worker can't
+# take down workers forever. Failed tries are retried after a backoff.
+class WorkQueue(store_bases.WorkQueue):
+    # use a connection of our own so leases commit independently of the work
+    subDB = "work"
+    leaseSeconds = 10 * 60
+    retryDelay = 60
+
+    @classmethod
+    def enqueue(
+        cls, kind: str, payload: str, priority: int = 0, maxTries: int = 5
+    ) -> bool:
+        conn = cls.getConnection()
+        with conn.cursor() as curs:
+            curs.execute(
+                """
+                insert into work_queue(kind, payload, priority, maxTries)
+                values(%s, %s, %s, %s)
+                on conflict (kind, payload) where status in ('pending', 'leased')
+                do nothing
+            """,
+                (kind, payload, priority, maxTries),
+            )
+            added = curs.rowcount > 0
+        conn.commit()
+        return added
+
+    # lease up to count jobs, highest priority first
+    @classmethod
+    def lease(
+        cls,
+        worker: str,
+        kinds: Optional[List[str]] = None,
+        count: int = 1,
+        leaseSeconds: Optional[int] = None,
+    ) -> List["WorkQueue"]:
+        now = int(time.time())
+        leaseSeconds = cls.leaseSeconds if leaseSeconds is None else leaseSeconds
+        kindSql = "" if kinds is None else "and kind = any(%(kinds)s)"
+        data = {
+            "now": now,
+            "kinds": kinds,
+            "count": count,
+            "until": now + leaseSeconds,
+            "worker": worker,
+            "finished": OilTimestamp.now(),
+        }
+        conn = cls.getConnection()
+        with conn.cursor() as curs:
+            # the worker holding these died (or hung) on the last try
+            curs.execute(
+                f"""
+                update work_queue
+                set status = 'failed', finished = %(finished)s, leasedBy = null,
+                    lastError = 'lease expired on final try ' || tries
+                where status = 'leased' and visibleAt <= %(now)s
+                    and tries >= maxTries {kindSql}
+            """,
+                data,
             )
-        if len(es) >= 1:
-            es[0].name = name
-            es[0].url = url
-            es[0].localId = localId
-            es[0].update()
-            return es[0].id
-        if len(es) > 0:
-            raise Exception("FIXME")
-
-        e = AuthorSource.new()
-        e.authorId = authorId
-        e.sourceId = sourceId
-        e.name = name
-        e.url = url
-        e.localId = localId
-        e.insert()
-        return AuthorSource.getId(authorId, sourceId, name, url, localId)
-
-
-# TODO FIXME
-# class QueueStatus(IntEnum):
-# pending = 0
-# done = 1
-# broken = 2
-#
-# class ImportQueue(store_bases.ImportQueueBase):
-# def __init__(self, genId: bool = False):
-# pass
-# @staticmethod
-# def enqueue(ident: str) -> None:
-# q = ImportQueue.new()
-# q.ident = ident
-# q.added = int(time.time())
-# q.touched = None
-# q.tries = 0
-# q.status = QueueStatus.pending
-# q.upsert()
+            curs.execute(
+                f"""
+                with next as (
+                    select id from work_queue
+                    where status in ('pending', 'leased') and visibleAt <= %(now)s
+                        and tries < maxTries {kindSql}
+                    order by priority desc, id asc
+                    limit %(count)s
+                    for update skip locked
+                )
+                update work_queue w
+                set status = 'leased', tries = w.tries + 1,
+                    visibleAt = %(until)s, leasedBy = %(worker)s
+                from next
+                where w.id = next.id
+                returning w.*
+            """,
+                data,
+            )
+            res = [cls.fromRow(r) for r in curs.fetchall()]
+        conn.commit()
+        res.sort(key=lambda w: (-w.priority, w.id))
+        return res
+
+    # apply an update to this job only while we still hold its lease
+    def _finish(self, sql: str, data: Tuple[Any, ...]) -> bool:
+        conn = type(self).getConnection()
+        with conn.cursor() as curs:
+            curs.execute(
+                sql + " where id = %s and tries = %s and leasedBy = %s",
+                data + (self.id, self.tries, self.leasedBy),
+            )
+            held = curs.rowcount > 0
+        conn.commit()
+        return held
+
+    def complete(self) -> bool:
+        self.status = WorkStatus.done
+        self.finished = OilTimestamp.now()
+        return self._finish(
+            "update work_queue set status = 'done', finished = %s, leasedBy = null",
+            (self.finished,),
+        )
+
+    def fail(self, error: str) -> bool:
+        self.lastError = error
+        if self.tries >= self.maxTries:
+            self.status = WorkStatus.failed
+            self.finished = OilTimestamp.now()
+            return self._finish(
+                "update work_queue set status = 'failed', finished = %s,"
+                + " lastError = %s, leasedBy = null",
+                (self.finished, error),
+            )
+        self.status = WorkStatus.pending
+        self.visibleAt = int(time.time()) + type(self).retryDelay * 2 ** (
+            self.tries - 1
+        )
+        return self._finish(
+            "update work_queue set status = 'pending', visibleAt = %s,"
+            + " lastError = %s, leasedBy = null",
+            (self.visibleAt, error),
+        )
+
+    # push the lease out for long running jobs
+    def renew(self, leaseSeconds: Optional[int] = None) -> bool:
+        leaseSeconds = type(self).leaseSeconds if leaseSeconds is None else leaseSeconds
+        self.visibleAt = int(time.time()) + leaseSeconds
+        return self._finish("update work_queue set visibleAt = %s", (self.visibleAt,))
+
+    @classmethod
+    def counts(cls) -> Dict[Tuple[str, str], int]:
+        conn = cls.getConnection()
+        with conn.cursor() as curs:
+            curs.execute(
+                "select kind, status::text, count(1) from work_queue"
+                + " group by kind, status"
+            )
+            res = {(str(r[0]), str(r[1])): int(r[2]) for r in curs.fetchall()}
+        conn.commit()
+        return res
+
 
 initFicTagCache()
@@ -6,10 +6,10 @@ import os
 import random
 import re
 import time
-import zlib
 
 import dateutil.parser
 
+import codec
 from schema import OilTimestamp
 
 defaultLogFile = "hermes.log"
@@ -337,16 +337,13 @@ def cleanChapterTitle(title: str, cid: int) -> str:
     return title
 
 
-def compress(s: bytes) -> bytes:
-    return len(s).to_bytes(4, byteorder="big") + zlib.compress(s, level=9)
+def compress(s: bytes, url: Optional[str] = None) -> bytes:
+    # url selects a per domain dictionary when the codec supports one
+    return codec.compress(s, url)
 
 
 def decompress(b: bytes) -> bytes:
-    elen = int.from_bytes(b[:4], byteorder="big")
-    res = zlib.decompress(b[4:])
-    if len(res) != elen:
-        raise Exception(f"expected {elen} but got {len(res)} bytes")
-    return res
+    return codec.decompress(b)
 
 
 def decodeCloudFlareEmail(email: str) -> str:
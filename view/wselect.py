@@ -299,7 +299,10 @@ class FicSelect(Widget):
         # TODO FIXME bleh
         userFics = {uf.ficId: uf for uf in UserFic.select({"userId": 1})}
 
-        for fic in self.fics if completelyRefilter else self.list:
+        candidates = self.fics if completelyRefilter else self.list
+        if fandomRel is not None:
+            Fic.prefetchTags(candidates)
+        for fic in candidates:
             if fic.id not in userFics:
                 userFics[fic.id] = UserFic.default((1, fic.id))
             userFic = userFics[fic.id]
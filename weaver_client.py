@@ -4,7 +4,6 @@ import urllib.parse
 from scrape import (
     ScrapeMeta,
     canonizeUrl,
-    getLastUrlLike,
     getMostRecentScrapeWithMeta,
 )
 from skitter_client import SkitterClient, saveWebRequest
@@ -35,10 +34,8 @@ class WeaverClient(SkitterClient):
     def softScrape(self, url: str) -> ScrapeMeta:
         url = canonizeUrl(url)
         # check if we already have it in our db, return it if we do
-        tmpUrl = getLastUrlLike(url)
-        if tmpUrl is not None:
-            res = getMostRecentScrapeWithMeta(url)
-            assert res is not None
+        res = getMostRecentScrapeWithMeta(url)
+        if res is not None:
             return res
 
         # otherwise call upstream .softCrawl
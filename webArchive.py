@@ -0,0 +1,627 @@
+#!/usr/bin/env python
+# maintenance commands for the web archive held in minerva.
+#
+# usage: webArchive.py dedup [batch size]
+#   moves inline web.response bodies into the content addressed web_blob
+#   table so identical responses are only stored once. Existing compressed
+#   bytes are reused as is. This can be stopped and restarted at any time; it
+#   resumes from rows that still have an inline response. Once it finishes a
+#   `vacuum full web` is needed to actually give the space back.
+#
+# usage: webArchive.py trainDicts [samples per domain] [dictionary size]
+#   trains a zstd dictionary for each of dictionaryDomains from recent
+#   responses and stores it in web_dict. New rows for those domains use the
+#   newest dictionary; old rows keep referencing the one they were written
+#   with, so never delete web_dict rows.
+#
+# usage: webArchive.py benchCodecs [samples per domain]
+#   compares compression ratio and throughput of the available codecs on a
+#   sample of the archive. Dictionaries are trained on half of the sample and
+#   measured on the other half.
+#
+# usage: webArchive.py urlKeys [batch size]
+#   fills in web.urlKey for rows written before it existed. Rows without a key
+#   are invisible to key based lookups, so run this once after applying
+#   web_url_key.sql. Like dedup it can be stopped and restarted.
+#
+# usage: webArchive.py migrate
+#   converts an unpartitioned web table into one partitioned by month of
+#   created. The old table is kept as the web_legacy partition holding
+#   everything before the current month. Run it once, with hermes stopped.
+#
+# usage: webArchive.py partitions [months ahead]
+#   creates monthly partitions of web from the current month through [months
+#   ahead] (default 3). Run it from cron; rows for months without a partition
+#   land in web_default and are moved when their partition is created.
+#
+# usage: webArchive.py archive <partition> [segment directory]
+#   writes a partition from before the current month out to monthly segment
+#   files (see segment.py), then detaches and drops it. The directory defaults
+#   to $HERMES_SEGMENTS, which is also where scrape looks for archived rows.
+#   Follow with gcblobs to drop bodies only the archived rows referenced.
+#
+# usage: webArchive.py export [segment directory] [batch size]
+#   appends every web row not yet exported to monthly segment files, along
+#   with the compression dictionaries. With HERMES_SEGMENTS pointing at a copy
+#   of the directory and HERMES_SEGMENTS_ONLY set, stale only scraping (for
+#   re-extraction) reads the archive from the segments alone and never
+#   queries the web tables. Run it again to pick up newer rows.
+#
+# usage: webArchive.py gcblobs [batch size]
+#   deletes web_blob rows no longer referenced by any web row.
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+import calendar
+import os
+import re
+import sys
+import time
+import zlib
+
+import codec
+import scrape
+import segment
+import util
+
+if TYPE_CHECKING:
+    from psycopg2 import cursor  # type: ignore[attr-defined]
+
+dictionaryDomains = [
+    "fanfiction.net",
+    "archiveofourown.org",
+    "spacebattles.com",
+    "sufficientvelocity.com",
+    "questionablequesting.com",
+]
+
+# dictionary id used for throwaway benchmark dictionaries
+benchDictionaryId = 0xFFFFFFFF
+
+
+def dedup(batchSize: int = 1000) -> None:
+    conn = scrape.openMinerva()
+    lastId = -1
+    moved = 0
+    while True:
+        curs = conn.cursor()
+        curs.execute(
+            """
+        select w.id, w.response
+        from web w
+        where w.id > %s and w.response is not null and w.responseHash is null
+        order by w.id asc
+        limit %s
+        """,
+            (lastId, batchSize),
+        )
+        rows = curs.fetchall()
+        if len(rows) == 0:
+            curs.close()
+            break
+
+        for wid, response in rows:
+            compressed = response.tobytes()
+            responseHash = scrape.hashWebResponse(util.decompress(compressed))
+            curs.execute(
+                (
+                    "insert into web_blob(hash, response) values(%s, %s)"
+                    + " on conflict (hash) do nothing"
+                ),
+                (responseHash, compressed),
+            )
+            curs.execute(
+                "update web set responseHash = %s, response = null where id = %s",
+                (responseHash, wid),
+            )
+            lastId = wid
+
+        curs.close()
+        conn.commit()
+        moved += len(rows)
+        print(f"dedup: moved {moved} responses (last id {lastId})")
+
+    scrape.closeMinerva()
+
+
+def urlKeys(batchSize: int = 10000) -> None:
+    from psycopg2.extras import execute_values
+
+    conn = scrape.openMinerva()
+    lastId = -1
+    filled = 0
+    while True:
+        curs = conn.cursor()
+        curs.execute(
+            """
+        select w.id, w.url
+        from web w
+        where w.id > %s and w.urlKey is null
+        order by w.id asc
+        limit %s
+        """,
+            (lastId, batchSize),
+        )
+        rows = curs.fetchall()
+        if len(rows) == 0:
+            curs.close()
+            break
+
+        execute_values(
+            curs,
+            """
+        update web set urlKey = v.urlKey
+        from (values %s) as v(id, urlKey)
+        where web.id = v.id
+        """,
+            [(wid, scrape.urlKey(url)) for wid, url in rows],
+        )
+        lastId = rows[-1][0]
+
+        curs.close()
+        conn.commit()
+        filled += len(rows)
+        print(f"urlKeys: filled {filled} keys (last id {lastId})")
+
+    scrape.closeMinerva()
+
+
+def monthStart(year: int, month: int) -> int:
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+
+def addMonths(year: int, month: int, n: int) -> Tuple[int, int]:
+    m = year * 12 + (month - 1) + n
+    return (m // 12, m % 12 + 1)
+
+
+def currentMonth() -> Tuple[int, int]:
+    now = time.gmtime()
+    return (now.tm_year, now.tm_mon)
+
+
+def partitionName(year: int, month: int) -> str:
+    return f"web_y{year:04}m{month:02}"
+
+
+# map web partition names to their (lower, upper) created bounds; None means
+# unbounded (or the default partition)
+def listPartitions() -> Dict[str, Tuple[Optional[int], Optional[int]]]:
+    conn = scrape.openMinerva()
+    curs = conn.cursor()
+    curs.execute(
+        """
+    select c.relname, pg_get_expr(c.relpartbound, c.oid)
+    from pg_inherits i
+    join pg_class c on c.oid = i.inhrelid
+    where i.inhparent = 'web'::regclass
+    """
+    )
+    res: Dict[str, Tuple[Optional[int], Optional[int]]] = {}
+    for name, bound in curs.fetchall():
+        m = re.match("FOR VALUES FROM \\((.*)\\) TO \\((.*)\\)", bound)
+        if m is None:
+            res[name] = (None, None)
+            continue
+        lo, hi = (v.strip("'") for v in m.groups())
+        res[name] = (
+            None if lo == "MINVALUE" else int(lo),
+            None if hi == "MAXVALUE" else int(hi),
+        )
+    curs.close()
+    return res
+
+
+def runSql(curs: "cursor", path: str) -> None:
+    with open(path) as f:
+        curs.execute(f.read())
+
+
+def partitions(ahead: int = 3) -> None:
+    existing = listPartitions()
+    conn = scrape.openMinerva()
+    year, month = currentMonth()
+    for n in range(ahead + 1):
+        y, m = addMonths(year, month, n)
+        name = partitionName(y, m)
+        if name in existing:
+            continue
+        lo, hi = monthStart(y, m), monthStart(*addMonths(y, m, 1))
+        curs = conn.cursor()
+        curs.execute(
+            "select 1 from web_default where created >= %s and created < %s limit 1",
+            (lo, hi),
+        )
+        if curs.fetchone() is None:
+            curs.execute(
+                f"create table {name} partition of web for values from (%s) to (%s)",
+                (lo, hi),
+            )
+        else:
+            # the new partition can't be attached while web_default holds
+            # rows that belong in it, so move them over
+            curs.execute("alter table web detach partition web_default")
+            curs.execute(
+                f"create table {name} partition of web for values from (%s) to (%s)",
+                (lo, hi),
+            )
+            curs.execute(
+                f"""
+            with moved as (
+                delete from web_default
+                where created >= %s and created < %s
+                returning *
+            )
+            insert into {name} select * from moved
+            """,
+                (lo, hi),
+            )
+            curs.execute("alter table web attach partition web_default default")
+        curs.close()
+        conn.commit()
+        print(f"partitions: created {name}")
+    scrape.closeMinerva()
+
+
+def migrate() -> None:
+    conn = scrape.openMinerva()
+    curs = conn.cursor()
+    curs.execute("select relkind from pg_class where relname = 'web'")
+    r = curs.fetchone()
+    if r is not None and r[0] == "p":
+        print("migrate: web is already partitioned")
+        curs.close()
+        return
+
+    # make sure the old table has every column the new one does
+    runSql(curs, "./sql/web/web_response_hash.sql")
+    runSql(curs, "./sql/web/web_url_key.sql")
+    runSql(curs, "./sql/web/web_validators.sql")
+
+    curs.execute("alter table web rename to web_legacy")
+    curs.execute("alter index web_pkey rename to web_legacy_pkey")
+    for idx in ["idx_web_url", "idx_web_response_hash", "idx_web_url_key"]:
+        curs.execute(f"alter index if exists {idx} rename to {idx}_legacy")
+
+    for path in [
+        "./sql/web/web.sql",
+        "./sql/web/idx_web_url.sql",
+        "./sql/web/web_default.sql",
+        "./sql/web/idx_web_response_hash.sql",
+        "./sql/web/idx_web_url_key.sql",
+    ]:
+        runSql(curs, path)
+    curs.execute(
+        """
+    select setval(pg_get_serial_sequence('web', 'id'),
+        (select coalesce(max(id), 1) from web_legacy))
+    """
+    )
+
+    # rows from this month go through the new monthly partitions instead
+    boundary = monthStart(*currentMonth())
+    columns = "id, created, url, urlKey, status, source, response, responseHash"
+    columns += ", etag, lastModified"
+    curs.execute(
+        f"""
+    with moved as (
+        delete from web_legacy where created >= %s
+        returning {columns}
+    )
+    insert into web({columns}) select {columns} from moved
+    """,
+        (boundary,),
+    )
+    curs.execute(
+        "alter table web attach partition web_legacy"
+        + " for values from (minvalue) to (%s)",
+        (boundary,),
+    )
+    curs.close()
+    conn.commit()
+    print(f"migrate: attached old rows as web_legacy (created < {boundary})")
+
+    partitions()
+
+
+# append (id, created, url, status, source, response) rows to the monthly
+# segment in directory each belongs to, returning how many rows were seen.
+# Rows a previous run already wrote are skipped.
+def appendSegments(
+    directory: str,
+    rows: Iterable[Tuple[int, int, str, int, Optional[str], Any]],
+    writers: Dict[str, segment.SegmentWriter],
+) -> int:
+    count = 0
+    for wid, created, url, status, source, response in rows:
+        t = time.gmtime(created)
+        path = os.path.join(directory, partitionName(t.tm_year, t.tm_mon))
+        if path not in writers:
+            writers[path] = segment.SegmentWriter(path)
+        writer = writers[path]
+        count += 1
+        if wid <= writer.maxId:
+            continue
+        body = None if response is None else response.tobytes()
+        writer.append(wid, created, url, status, source, body)
+    return count
+
+
+def exportDictionaries(directory: str) -> None:
+    conn = scrape.openMinerva()
+    curs = conn.cursor()
+    curs.execute("select id, domain, codec, dict from web_dict order by id asc")
+    segment.writeDictionaries(
+        directory, [(r[0], r[1], r[2], r[3].tobytes()) for r in curs.fetchall()]
+    )
+    curs.close()
+
+
+def archive(name: str, directory: Optional[str] = None) -> None:
+    directory = segment.getArchiveDirectory() if directory is None else directory
+    if directory is None:
+        raise Exception("archive: no segment directory given or in HERMES_SEGMENTS")
+    existing = listPartitions()
+    if name not in existing:
+        raise Exception(f"archive: not a partition of web: {name}")
+    hi = existing[name][1]
+    if hi is None or hi > monthStart(*currentMonth()):
+        raise Exception(f"archive: refusing to archive {name}, it may still grow")
+    os.makedirs(directory, exist_ok=True)
+    exportDictionaries(directory)
+
+    conn = scrape.openMinerva()
+    curs = conn.cursor(name="webArchive")
+    curs.itersize = 1000
+    curs.execute(
+        f"""
+    select w.id, w.created, w.url, w.status, w.source,
+        coalesce(b.response, w.response)
+    from {name} w
+    left join web_blob b on b.hash = w.responseHash
+    order by w.id asc
+    """
+    )
+    writers: Dict[str, segment.SegmentWriter] = {}
+    count = appendSegments(directory, curs, writers)
+    curs.close()
+    for writer in writers.values():
+        writer.close()
+
+    curs = conn.cursor()
+    curs.execute(f"select count(1) from {name}")
+    r = curs.fetchone()
+    if r is None or r[0] != count:
+        raise Exception(f"archive: {name}: row count changed while archiving")
+    curs.execute(f"alter table web detach partition {name}")
+    curs.execute(f"drop table {name}")
+    curs.close()
+    conn.commit()
+    scrape.closeMinerva()
+    print(f"archive: {name}: moved {count} rows to {len(writers)} segments")
+
+
+def export(directory: Optional[str] = None, batchSize: int = 10000) -> None:
+    directory = segment.getArchiveDirectory() if directory is None else directory
+    if directory is None:
+        raise Exception("export: no segment directory given or in HERMES_SEGMENTS")
+    os.makedirs(directory, exist_ok=True)
+    exportDictionaries(directory)
+
+    # the last id every segment has durably written, so a restart can skip
+    # straight to it instead of rescanning the table
+    resumePath = os.path.join(directory, "export.last")
+    lastId = -1
+    if os.path.isfile(resumePath):
+        with open(resumePath) as f:
+            lastId = int(f.read().strip())
+
+    conn = scrape.openMinerva()
+    writers: Dict[str, segment.SegmentWriter] = {}
+    exported = 0
+    while True:
+        curs = conn.cursor()
+        curs.execute(
+            """
+        select w.id, w.created, w.url, w.status, w.source,
+            coalesce(b.response, w.response)
+        from web w
+        left join web_blob b on b.hash = w.responseHash
+        where w.id > %s
+        order by w.id asc
+        limit %s
+        """,
+            (lastId, batchSize),
+        )
+        rows = curs.fetchall()
+        curs.close()
+        conn.commit()
+        if len(rows) == 0:
+            break
+
+        exported += appendSegments(directory, rows, writers)
+        for writer in writers.values():
+            writer.flush()
+        lastId = rows[-1][0]
+        with open(resumePath + ".tmp", "w") as f:
+            f.write(f"{lastId}\n")
+        os.replace(resumePath + ".tmp", resumePath)
+        print(f"export: exported {exported} rows (last id {lastId})")
+
+    for writer in writers.values():
+        writer.close()
+    scrape.closeMinerva()
+    print(f"export: {len(writers)} segments updated in {directory}")
+
+
+def gcblobs(batchSize: int = 10000) -> None:
+    conn = scrape.openMinerva()
+    lastHash = b""
+    deleted = 0
+    while True:
+        curs = conn.cursor()
+        curs.execute(
+            "select hash from web_blob where hash > %s order by hash asc limit %s",
+            (lastHash, batchSize),
+        )
+        hashes = [r[0].tobytes() for r in curs.fetchall()]
+        if len(hashes) == 0:
+            curs.close()
+            break
+        curs.execute(
+            """
+        delete from web_blob b
+        where b.hash = any(%s)
+            and not exists (select 1 from web w where w.responseHash = b.hash)
+        """,
+            (hashes,),
+        )
+        deleted += curs.rowcount
+        lastHash = hashes[-1]
+        curs.close()
+        conn.commit()
+        print(f"gcblobs: deleted {deleted} unreferenced blobs")
+    scrape.closeMinerva()
+
+
+def sampleResponses(domain: str, count: int) -> List[bytes]:
+    conn = scrape.openMinerva()
+    curs = conn.cursor()
+    curs.execute(
+        """
+    select coalesce(b.response, w.response)
+    from web w
+    left join web_blob b on b.hash = w.responseHash
+    where w.status = 200 and w.url like %s
+        and (w.response is not null or w.responseHash is not null)
+    order by w.id desc
+    limit %s
+    """,
+        (f"%{domain}/%", count),
+    )
+    res = [util.decompress(r[0].tobytes()) for r in curs.fetchall()]
+    curs.close()
+    scrape.closeMinerva()
+    return res
+
+
+def trainDicts(samples: int = 2000, size: int = 112640) -> None:
+    for domain in dictionaryDomains:
+        data = sampleResponses(domain, samples)
+        if len(data) < 10:
+            print(f"trainDicts: {domain}: only {len(data)} samples, skipping")
+            continue
+        d = codec.trainDictionary(data, size)
+        did = codec.saveDictionary(domain, codec.codecZstd, d)
+        print(f"trainDicts: {domain}: {len(data)} samples => dictionary {did}")
+
+
+def compressLegacy(s: bytes) -> bytes:
+    return len(s).to_bytes(4, byteorder="big") + zlib.compress(s, level=9)
+
+
+def benchCodec(
+    name: str, data: List[bytes], compress: Callable[[bytes], bytes]
+) -> Tuple[str, int, int, float, float]:
+    t0 = time.perf_counter()
+    blobs = [compress(d) for d in data]
+    t1 = time.perf_counter()
+    for blob, d in zip(blobs, data):
+        if util.decompress(blob) != d:
+            raise Exception(f"benchCodecs: {name} did not round trip")
+    t2 = time.perf_counter()
+    rawLen = sum([len(d) for d in data])
+    return (name, rawLen, sum([len(b) for b in blobs]), t1 - t0, t2 - t1)
+
+
+def benchCodecs(samples: int = 500) -> None:
+    mb = 1024 * 1024
+    print(f"{'domain':<26} {'codec':<12} {'ratio':>7} {'c MB/s':>8} {'d MB/s':>8}")
+    for domain in dictionaryDomains:
+        data = sampleResponses(domain, samples)
+        if len(data) < 10:
+            print(f"{domain:<26} only {len(data)} samples, skipping")
+            continue
+        train, test = data[1::2], data[0::2]
+        results = [
+            benchCodec("zlib-9 (old)", test, compressLegacy),
+            benchCodec(
+                f"zlib-{codec.zlibLevel}",
+                test,
+                lambda s: codec.compressWith(s, codec.codecZlib),
+            ),
+        ]
+        if codec.haveZstd():
+            results.append(
+                benchCodec(
+                    f"zstd-{codec.zstdLevel}",
+                    test,
+                    lambda s: codec.compressWith(s, codec.codecZstd),
+                )
+            )
+            d = codec.trainDictionary(train, 112640)
+            codec.registerDictionary(benchDictionaryId, "bench", codec.codecZstd, d)
+            results.append(
+                benchCodec(
+                    f"zstd-{codec.zstdLevel}+dict",
+                    test,
+                    lambda s: codec.compressWith(s, codec.codecZstd, benchDictionaryId),
+                )
+            )
+        for name, rawLen, compLen, ct, dt in results:
+            print(
+                f"{domain:<26} {name:<12} {rawLen / compLen:>7.2f}"
+                + f" {rawLen / mb / ct:>8.1f} {rawLen / mb / dt:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: webArchive.py dedup [batch size]")
+        print("       webArchive.py trainDicts [samples per domain] [dict size]")
+        print("       webArchive.py benchCodecs [samples per domain]")
+        print("       webArchive.py urlKeys [batch size]")
+        print("       webArchive.py migrate")
+        print("       webArchive.py partitions [months ahead]")
+        print("       webArchive.py archive <partition> [segment directory]")
+        print("       webArchive.py export [segment directory] [batch size]")
+        print("       webArchive.py gcblobs [batch size]")
+        sys.exit(1)
+
+    if sys.argv[1] == "dedup":
+        dedup(int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+    elif sys.argv[1] == "trainDicts":
+        trainDicts(
+            int(sys.argv[2]) if len(sys.argv) > 2 else 2000,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 112640,
+        )
+    elif sys.argv[1] == "benchCodecs":
+        benchCodecs(int(sys.argv[2]) if len(sys.argv) > 2 else 500)
+    elif sys.argv[1] == "urlKeys":
+        urlKeys(int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
+    elif sys.argv[1] == "migrate":
+        migrate()
+    elif sys.argv[1] == "partitions":
+        partitions(int(sys.argv[2]) if len(sys.argv) > 2 else 3)
+    elif sys.argv[1] == "archive":
+        if len(sys.argv) < 3:
+            print("usage: webArchive.py archive <partition> [segment directory]")
+            sys.exit(1)
+        archive(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    elif sys.argv[1] == "export":
+        export(
+            sys.argv[2] if len(sys.argv) > 2 else None,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 10000,
+        )
+    elif sys.argv[1] == "gcblobs":
+        gcblobs(int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
+    else:
+        print(f"unknown command: {sys.argv[1]}")
+        sys.exit(1)